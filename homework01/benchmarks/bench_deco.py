@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""Скорость n_ary на длинных списках аргументов: рекурсивная свертка
+(до рекурсии Python не дотягивает), итеративная и попарная (tree=True).
+
+    python2 -m benchmarks.bench_deco -n 10000
+"""
+from __future__ import print_function
+
+import argparse
+import operator
+import timeit
+
+import deco
+
+
+def recursive_n_ary(f):
+    """Прежняя реализация n_ary: один уровень рекурсии на аргумент"""
+    def wrapper(x, *args):
+        return x if not args else f(x, wrapper(*args))
+    return wrapper
+
+
+def bench(f, args, repeat):
+    return min(timeit.repeat(lambda: f(*args), number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser("Скорость n_ary")
+    parser.add_argument("-n", dest="n_args", type=int, default=10000,
+        help="Число аргументов")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    # Рекурсивная версия упирается в sys.getrecursionlimit(), поэтому
+    # для нее берется не больше 300 аргументов
+    n_recursive = min(args.n_args, 300)
+    cases = [
+        ("int add", operator.add, range(args.n_args)),
+        ("str concat", operator.add, [str(i) for i in range(args.n_args)]),
+        ("list concat", operator.add, [[i] for i in range(args.n_args)]),
+    ]
+    for name, f, values in cases:
+        print("{} ({} args):".format(name, args.n_args))
+        print("{:>20}: {:10.6f} s ({} args)".format(
+            "recursive", bench(recursive_n_ary(f), values[:n_recursive], args.repeat), n_recursive))
+        print("{:>20}: {:10.6f} s".format("iterative", bench(deco.n_ary(f), values, args.repeat)))
+        print("{:>20}: {:10.6f} s".format("tree", bench(deco.n_ary(tree=True)(f), values, args.repeat)))
+
+
+if __name__ == "__main__":
+    main()
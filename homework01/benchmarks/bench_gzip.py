@@ -0,0 +1,53 @@
+"""Скорость чтения строк лога: текстовый файл, gzip.open в текстовом режиме
+(прежний способ) и потоковая распаковка read_lines.
+
+    python -m benchmarks.bench_gzip -n 2000000
+"""
+import argparse
+import datetime
+import gzip
+import itertools
+import pathlib
+import tempfile
+import time
+
+import log_analyzer
+from benchmarks.loggen import make_line_pool
+
+
+def bench(lines, n_lines):
+    started = time.perf_counter()
+    for line in lines:
+        log_analyzer.fast_process_line(line)
+    return n_lines / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser("Скорость чтения gzip-логов")
+    parser.add_argument("-n", dest="n_lines", type=int, default=2000000,
+        help="Число строк синтетического лога")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        plain_path = pathlib.Path(tmp_dir) / "nginx-access-ui.log-20170630"
+        gz_path = plain_path.with_name(plain_path.name + ".gz")
+        pool = make_line_pool(10000)
+        with plain_path.open(mode="wb") as f:
+            f.writelines(itertools.islice(itertools.cycle(pool), args.n_lines))
+        with plain_path.open(mode="rb") as src, gzip.open(str(gz_path), mode="wb") as dst:
+            dst.write(src.read())
+
+        date = datetime.date(2017, 6, 30)
+        plain_log = log_analyzer.Log(plain_path, date, "")
+        gz_log = log_analyzer.Log(gz_path, date, ".gz")
+        cases = [
+            ("plain", lambda: log_analyzer.read_lines(plain_log)),
+            ("gzip.open rt", lambda: (line.encode() for line in gzip.open(str(gz_path), mode="rt"))),
+            ("gzip stream", lambda: log_analyzer.read_lines(gz_log)),
+        ]
+        for name, make_lines in cases:
+            print(f"{name:>14}: {bench(make_lines(), args.n_lines):,.0f} lines/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""Замеры производительности log_analyzer на синтетическом логе.
+
+Печатает скорость и время каждой стадии (чтение, разбор, агрегация,
+статистика, отчет), затем время process_log и полного запуска main
+с пиковым RSS процесса, в котором он выполнялся.
+
+    python -m benchmarks.bench_log_analyzer -n 1000000 --urls 10000 --gz --profile main.prof
+"""
+import argparse
+import cProfile
+import datetime
+import multiprocessing
+import pathlib
+import resource
+import shutil
+import tempfile
+import time
+
+import log_analyzer
+from benchmarks.loggen import write_log
+
+
+TEMPLATE_PATH = pathlib.Path(__file__).parent.parent / "report.html"
+
+
+def timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # ru_maxrss в килобайтах в Linux
+    return resource.getrusage(who).ru_maxrss / 1024.
+
+
+def print_row(name, elapsed, n_lines):
+    print(f"{name:>14}: {elapsed:8.3f} s {n_lines / elapsed:14,.0f} lines/sec")
+
+
+def bench_stages(log, config, n_lines):
+    settings = log_analyzer.Settings(config["AGGREGATION"], config["STRIP_QUERY"],
+                                     config["COLLAPSE_IDS"], config["MAX_URLS"], config["TIME_SERIES"])
+    lines, elapsed = timed(list, log_analyzer.read_lines(log, use_mmap=config["USE_MMAP"]))
+    print_row("read", elapsed, n_lines)
+    requests, elapsed = timed(lambda: [log_analyzer.fast_process_line(line) for line in lines])
+    print_row("parse", elapsed, n_lines)
+    del lines
+
+    def aggregate():
+        aggregator = log_analyzer.AGGREGATORS[settings.aggregation](settings.max_urls)
+        for request in requests:
+            if request:
+                aggregator.add(request.url, request.request_time)
+        return aggregator
+
+    aggregator, elapsed = timed(aggregate)
+    print_row("aggregate", elapsed, n_lines)
+    del requests
+    log_statistics, elapsed = timed(log_analyzer.get_statistics, aggregator, config["REPORT_SIZE"])
+    print_row("stats", elapsed, n_lines)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        report_path = pathlib.Path(tmp_dir) / "report.html"
+        _, elapsed = timed(log_analyzer.create_report, TEMPLATE_PATH, report_path, log_statistics)
+    print_row("render", elapsed, n_lines)
+
+
+def bench_process_log(log, config, n_lines):
+    _, elapsed = timed(log_analyzer.process_log, log, 1.,
+        report_size=config["REPORT_SIZE"],
+        workers=config["WORKERS"],
+        aggregation=config["AGGREGATION"],
+        strip_query=config["STRIP_QUERY"],
+        collapse_ids=config["COLLAPSE_IDS"],
+        max_urls=config["MAX_URLS"],
+        use_mmap=config["USE_MMAP"])
+    print_row("process_log", elapsed, n_lines)
+
+
+def run_main(config, profile_path):
+    if profile_path:
+        cProfile.runctx("log_analyzer.main(config)", globals(), {"config": config}, profile_path)
+    else:
+        log_analyzer.main(config)
+
+
+def bench_main(config, n_lines, profile_path):
+    # main запускается в отдельном процессе, чтобы пиковый RSS
+    # не включал память предыдущих замеров
+    process = multiprocessing.Process(target=run_main, args=(config, profile_path))
+    started = time.perf_counter()
+    process.start()
+    process.join()
+    print_row("main", time.perf_counter() - started, n_lines)
+    print(f"{'main peak RSS':>14}: {peak_rss_mb(resource.RUSAGE_CHILDREN):8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser("Замеры производительности log_analyzer")
+    parser.add_argument("-n", dest="n_lines", type=int, default=1000000, help="Число строк лога")
+    parser.add_argument("--urls", dest="n_urls", type=int, default=100000, help="Число различных URL")
+    parser.add_argument("--error-rate", type=float, default=0., help="Доля неразбираемых строк")
+    parser.add_argument("--gz", action="store_true", help="Сжатый gzip лог")
+    parser.add_argument("--config", dest="config_path", help="Конфигурация log_analyzer")
+    parser.add_argument("--skip-stages", action="store_true", help="Не замерять отдельные стадии")
+    parser.add_argument("--profile", dest="profile_path", help="Сохранить профиль cProfile запуска main")
+    args = parser.parse_args()
+
+    config = log_analyzer.get_config(args.config_path, log_analyzer.default_config)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        root = pathlib.Path(tmp_dir)
+        log_dir = root / "log"
+        report_dir = root / "reports"
+        log_dir.mkdir()
+        report_dir.mkdir()
+        shutil.copy(str(TEMPLATE_PATH), str(report_dir / "report.html"))
+        config = {
+            **config,
+            "LOG_DIR": str(log_dir),
+            "REPORT_DIR": str(report_dir),
+            "TS_FILE": str(root / "log_analyzer.ts"),
+            "ERRORS_TRESHOLD": 1.,
+        }
+
+        name = "nginx-access-ui.log-20170630" + (".gz" if args.gz else "")
+        path, elapsed = timed(write_log, log_dir / name, args.n_lines, args.n_urls, args.error_rate)
+        print(f"{name}: {path.stat().st_size / 2 ** 20:.1f} MB, generated in {elapsed:.1f} s")
+        log = log_analyzer.Log(path, datetime.date(2017, 6, 30), ".gz" if args.gz else "")
+
+        if not args.skip_stages:
+            bench_stages(log, config, args.n_lines)
+        bench_process_log(log, config, args.n_lines)
+        bench_main(config, args.n_lines, args.profile_path)
+        print(f"{'bench peak RSS':>14}: {peak_rss_mb():8.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
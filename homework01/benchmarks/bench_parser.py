@@ -0,0 +1,34 @@
+"""Сравнение скорости разбора строк: полное регулярное выражение против
+быстрого разбора формата ui.
+
+    python -m benchmarks.bench_parser -n 10000000
+"""
+import argparse
+import itertools
+import time
+
+import log_analyzer
+from benchmarks.loggen import make_line_pool
+
+
+def bench(parser, lines, n_lines):
+    started = time.perf_counter()
+    for line in itertools.islice(itertools.cycle(lines), n_lines):
+        parser(line)
+    return n_lines / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser("Скорость разбора строк лога")
+    parser.add_argument("-n", dest="n_lines", type=int, default=10000000,
+        help="Число строк синтетического лога")
+    args = parser.parse_args()
+
+    lines = make_line_pool(10000)
+    for name, func in [("process_line", lambda line: log_analyzer.process_line(line.decode())),
+                       ("fast_process_line", log_analyzer.fast_process_line)]:
+        print(f"{name:>20}: {bench(func, lines, args.n_lines):,.0f} lines/sec")
+
+
+if __name__ == "__main__":
+    main()
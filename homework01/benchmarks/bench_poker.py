@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+"""Скорость выбора лучшей "руки" из 7ми карт: перебор 21 комбинации
+с hand_rank, best_hand и пакетная batch_best_hands (нужен numpy).
+
+    python2 -m benchmarks.bench_poker -n 100000
+"""
+from __future__ import print_function
+
+import argparse
+import itertools
+import random
+import time
+
+import poker
+
+
+def timed(func, *args):
+    started = time.time()
+    result = func(*args)
+    return result, time.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser("Скорость оценки покерных рук")
+    parser.add_argument("-n", dest="n_hands", type=int, default=100000,
+        help="Число случайных рук из 7ми карт")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    hands = [rnd.sample(poker.ID_CARDS, 7) for _ in range(args.n_hands)]
+    # Таблицы строятся при первом вызове, их построение не замеряется
+    poker.best_hand(hands[0])
+
+    # Перебор с hand_rank медленный, он замеряется на части рук
+    n_slow = min(args.n_hands, 2000)
+    _, elapsed = timed(lambda: [max(itertools.combinations(hand, 5), key=poker.hand_rank)
+                                for hand in hands[:n_slow]])
+    print("{:>20}: {:12,.0f} hands/sec".format("hand_rank x 21", n_slow / elapsed))
+    _, elapsed = timed(lambda: [poker.best_hand(hand) for hand in hands])
+    print("{:>20}: {:12,.0f} hands/sec".format("best_hand", args.n_hands / elapsed))
+
+    if poker.np is None:
+        print("numpy не установлен, batch_best_hands не замеряется")
+        return
+    poker.build_batch_tables()
+    card_ids, elapsed = timed(poker.encode_hands, hands)
+    print("{:>20}: {:12,.0f} hands/sec".format("encode_hands", args.n_hands / elapsed))
+    _, elapsed = timed(poker.batch_best_hands, card_ids)
+    print("{:>20}: {:12,.0f} hands/sec".format("batch_best_hands", args.n_hands / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Генератор синтетических логов nginx в формате ui.
+
+    python -m benchmarks.loggen ./log/nginx-access-ui.log-20170630.gz -n 1000000 --urls 10000
+"""
+import argparse
+import datetime
+import gzip
+import itertools
+import pathlib
+import random
+
+
+LINE_TEMPLATE = (
+    '{ip} -  - [{time_local}] "{method} {url} HTTP/1.1" 200 927 "-" '
+    '"Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" '
+    '"1498697422-2190034393-4708-9752759" "dc7161be3" {request_time}\n'
+)
+BROKEN_LINES = [
+    '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "0" 400 166 "-" "-" "-" "-" "-" 0.000\n',
+    '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "GET /api/1 HTTP/1.1" 200\n',
+    '\n',
+]
+START_TIME = datetime.datetime(2017, 6, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=3)))
+
+
+def iter_log_lines(n_lines, n_urls=100000, error_rate=0., seed=0):
+    """Строки лога за сутки в байтах. Популярность URL убывает как 1/rank,
+    доля error_rate строк не разбирается анализатором."""
+    rnd = random.Random(seed)
+    urls = [f"/api/v2/banner/{i}" for i in range(n_urls)]
+    cum_weights = list(itertools.accumulate(1. / (i + 1) for i in range(n_urls)))
+    seconds_per_line = 86400. / max(n_lines, 1)
+    for i in range(n_lines):
+        if error_rate and rnd.random() < error_rate:
+            yield rnd.choice(BROKEN_LINES).encode()
+            continue
+        time_local = START_TIME + datetime.timedelta(seconds=int(i * seconds_per_line))
+        [url] = rnd.choices(urls, cum_weights=cum_weights)
+        yield LINE_TEMPLATE.format(
+            ip=".".join(str(rnd.randrange(256)) for _ in range(4)),
+            time_local=f"{time_local:%d/%b/%Y:%H:%M:%S %z}",
+            method="GET",
+            url=url,
+            request_time=f"{rnd.expovariate(5):.3f}").encode()
+
+
+def make_line_pool(size, seed=0):
+    return list(iter_log_lines(size, seed=seed))
+
+
+def write_log(path, n_lines, n_urls=100000, error_rate=0., seed=0):
+    """Пишет лог в path, сжимая его gzip, если имя заканчивается на .gz"""
+    path = pathlib.Path(path)
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(str(path), "wb") as f:
+        f.writelines(iter_log_lines(n_lines, n_urls, error_rate, seed))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser("Генерация синтетического лога nginx")
+    parser.add_argument("path", help="Путь к логу, .gz - сжатый")
+    parser.add_argument("-n", dest="n_lines", type=int, default=1000000, help="Число строк")
+    parser.add_argument("--urls", dest="n_urls", type=int, default=100000, help="Число различных URL")
+    parser.add_argument("--error-rate", type=float, default=0., help="Доля неразбираемых строк")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_log(args.path, args.n_lines, args.n_urls, args.error_rate, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,30 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import atexit
+import cPickle
+import hashlib
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+import timeit
 from functools import update_wrapper
 from functools import wraps
 
 
-def disable(f):
+MEMO_COUNTERS = ('hits', 'misses', 'evictions')
+# Fields of a link in the circular doubly linked list of memo results
+PREV, NEXT, KEY, RESULT, EXPIRES = range(5)
+# Histogram bucket of calls timed as 0 s, sorts before any exponent
+ZERO_TIME = None
+# perf_counter appeared in Python 3.3, default_timer is the best clock before it
+perf_counter = getattr(time, 'perf_counter', timeit.default_timer)
+
+
+def disable(f=None, *args, **kwargs):
     '''
     Disable a decorator by re-assigning the decorator's name
     to this function. For example, to turn off memoization:
@@ -36,32 +55,267 @@ def countcalls(f):
     return wrapper
 
 
-def memo(f):
+def freeze(value):
+    '''
+    Return a hashable equivalent of value: lists, dicts and sets
+    (nested ones too) are turned into tuples and frozensets tagged
+    with their type.
+    '''
+    if isinstance(value, (tuple, list)):
+        frozen = tuple(freeze(item) for item in value)
+        return frozen if isinstance(value, tuple) else (list, frozen)
+    if isinstance(value, dict):
+        return (dict, frozenset((k, freeze(v)) for k, v in value.iteritems()))
+    if isinstance(value, (set, frozenset)):
+        return (set, frozenset(value))
+    return value
+
+
+def update_attributes(wrapper, f):
+    '''Copy attributes of f (e.g. countcalls' calls) to its memo wrapper.'''
+    for name, value in f.__dict__.iteritems():
+        if name not in MEMO_COUNTERS:
+            setattr(wrapper, name, value)
+
+
+class StripedDict(object):
+    '''
+    Memo storage for functions called from several threads: keys are
+    spread over stripes dicts, each guarded by its own lock, so threads
+    working with different keys rarely wait for each other.
+    '''
+
+    def __init__(self, stripes=16):
+        self.stripes = [({}, threading.Lock()) for _ in xrange(stripes)]
+
+    def stripe(self, key):
+        return self.stripes[hash(key) % len(self.stripes)]
+
+    def __getitem__(self, key):
+        data, lock = self.stripe(key)
+        with lock:
+            return data[key]
+
+    def __setitem__(self, key, value):
+        data, lock = self.stripe(key)
+        with lock:
+            data[key] = value
+
+    def __len__(self):
+        return sum(len(data) for data, _ in self.stripes)
+
+    def clear(self):
+        for data, lock in self.stripes:
+            with lock:
+                data.clear()
+
+
+class FileStorage(object):
+    '''
+    Memo storage shared between processes (and between runs): each
+    result is pickled into its own file in directory named by a digest
+    of the pickled key. A file is written under a temporary name and
+    renamed, so readers never see a partial result.
+    '''
+
+    suffix = '.tmp'
+
+    def __init__(self, directory):
+        self.directory = directory
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+    def path(self, key):
+        digest = hashlib.sha1(cPickle.dumps(key, cPickle.HIGHEST_PROTOCOL)).hexdigest()
+        return os.path.join(self.directory, digest)
+
+    def __getitem__(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                return cPickle.load(f)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        fd, tmp_path = tempfile.mkstemp(suffix=self.suffix, dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                cPickle.dump(value, f, cPickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self.path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def names(self):
+        return [name for name in os.listdir(self.directory) if not name.endswith(self.suffix)]
+
+    def __len__(self):
+        return len(self.names())
+
+    def clear(self):
+        for name in self.names():
+            os.remove(os.path.join(self.directory, name))
+
+
+def memo(f=None, maxsize=None, ttl=None, key=None, timer=time.time, storage=None):
     '''
     Memoize a function so that it caches all return values for
     faster future lookups.
+
+    With maxsize at most maxsize results are kept, the least recently
+    used one is evicted first. With ttl a result older than ttl seconds
+    is computed again. Both are passed as @memo(maxsize=128, ttl=60).
+
+    The cache key is key(*args) if key is given, else the arguments
+    themselves; unhashable keys (e.g. lists) are converted with freeze.
+    Cache hits, misses and evictions (including expired results) are
+    counted in the hits, misses and evictions attributes.
+
+    Results of an unbounded memo are kept in storage: a dict by default,
+    or any mapping with __getitem__ and __setitem__, e.g.
+    StripedDict for thread pools, FileStorage or a
+    multiprocessing.Manager().dict() to share results between processes.
     '''
+    bounded = maxsize is not None or ttl is not None
+    if bounded and storage is not None:
+        raise ValueError("storage can't be used with maxsize or ttl")
+    if f is None:
+        return lambda f: memo(f, maxsize, ttl, key, timer, storage)
+    if bounded:
+        wrapper = lru_memo(f, maxsize, ttl, key, timer)
+    else:
+        wrapper = unbounded_memo(f, key, {} if storage is None else storage)
+    for name in MEMO_COUNTERS:
+        setattr(wrapper, name, 0)
+    return wrapper
+
+
+def unbounded_memo(f, key, cache):
+    # The cache (a dict or a thread-safe storage) is used without a lock;
+    # the lock only keeps the counters exact when called from several threads
+    lock = threading.Lock()
+
+    @wraps(f)
+    def wrapper(*args):
+        k = args if key is None else key(*args)
+        try:
+            hash(k)
+        except TypeError:
+            k = freeze(k)
+        try:
+            result = cache[k]
+        except KeyError:
+            pass
+        else:
+            with lock:
+                wrapper.hits += 1
+            return result
+        with lock:
+            wrapper.misses += 1
+        result = cache[k] = f(*args)
+        # f's attributes can only change when it is called
+        with lock:
+            update_attributes(wrapper, f)
+        return result
+    return wrapper
+
+
+def lru_memo(f, maxsize, ttl, key, timer):
     cache = {}
+    # Sentinel of the list: root[NEXT] is the least recently used link,
+    # root[PREV] is the most recently used one
+    root = []
+    root[:] = [root, root, None, None, None]
+    # The list is relinked on every call, so it is guarded by a lock;
+    # f itself is called without holding it
+    lock = threading.Lock()
+
     @wraps(f)
     def wrapper(*args):
-        if args not in cache:
-            cache[args] = f(*args)
-        update_wrapper(wrapper, f)
-        return cache[args]
+        k = args if key is None else key(*args)
+        try:
+            hash(k)
+        except TypeError:
+            k = freeze(k)
+        with lock:
+            link = cache.get(k)
+            if link is not None:
+                link_prev, link_next = link[PREV], link[NEXT]
+                link_prev[NEXT] = link_next
+                link_next[PREV] = link_prev
+                if ttl is None or timer() < link[EXPIRES]:
+                    last = root[PREV]
+                    last[NEXT] = root[PREV] = link
+                    link[PREV] = last
+                    link[NEXT] = root
+                    wrapper.hits += 1
+                    return link[RESULT]
+                del cache[k]
+                wrapper.evictions += 1
+            wrapper.misses += 1
+        result = f(*args)
+        with lock:
+            update_attributes(wrapper, f)
+            if k in cache:
+                # A recursive call (or another thread) has cached it already
+                return result
+            if maxsize is not None and len(cache) >= maxsize:
+                oldest = root[NEXT]
+                if oldest is root:
+                    return result
+                root[NEXT] = oldest[NEXT]
+                oldest[NEXT][PREV] = root
+                del cache[oldest[KEY]]
+                wrapper.evictions += 1
+            last = root[PREV]
+            expires = None if ttl is None else timer() + ttl
+            last[NEXT] = root[PREV] = cache[k] = [last, root, k, result, expires]
+        return result
     return wrapper
 
 
-def n_ary(f):
+def n_ary(f=None, tree=False):
     '''
     Given binary function f(x, y), return an n_ary function such
     that f(x, y, z) = f(x, f(y,z)), etc. Also allow f(x) = x.
+
+    The arguments are folded from the right in a loop, so any number
+    of them can be passed. If f is associative, @n_ary(tree=True)
+    combines neighbouring arguments pairwise instead, which keeps the
+    operands balanced (e.g. for string or list concatenation).
     '''
+    if f is None:
+        return lambda f: n_ary(f, tree)
     @wraps(f)
     def wrapper(x, *args):
-        return x if not args else f(x, wrapper(*args))
+        if not args:
+            return x
+        if tree:
+            return tree_reduce(f, (x,) + args)
+        result = args[-1]
+        for i in xrange(len(args) - 2, -1, -1):
+            result = f(args[i], result)
+        return f(x, result)
     return wrapper
 
 
+def tree_reduce(f, items):
+    '''
+    Reduce items with associative f level by level: f(f(a, b), f(c, d)),
+    the order of operands is kept.
+    '''
+    items = list(items)
+    while len(items) > 1:
+        reduced = [f(items[i], items[i + 1]) for i in xrange(0, len(items) - 1, 2)]
+        if len(items) % 2:
+            reduced.append(items[-1])
+        items = reduced
+    return items[0]
+
+
 def trace(fill_value):
     '''Trace calls made to function decorated.
 
@@ -98,6 +352,112 @@ def trace(fill_value):
     return trace_decorator
 
 
+class CallStats(object):
+    '''
+    Calls of a profiled function: count, total and self time in seconds
+    and a histogram of call times, the bucket e counts calls that took
+    [2 ** (e - 1), 2 ** e) seconds. Calls shorter than the timer
+    resolution (timed as 0 s) go to the ZERO_TIME bucket. Updates are
+    guarded by lock, the function may be called from several threads.
+    '''
+
+    __slots__ = ('name', 'lock', 'calls', 'total_time', 'self_time', 'histogram')
+
+    def __init__(self, name):
+        self.name = name
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.calls = 0
+            self.total_time = 0.
+            self.self_time = 0.
+            self.histogram = {}
+
+    def format_histogram(self):
+        buckets = []
+        for exponent, count in sorted(self.histogram.iteritems()):
+            if exponent is ZERO_TIME:
+                buckets.append("0s: {}".format(count))
+            else:
+                buckets.append("<{:.3g}s: {}".format(2. ** exponent, count))
+        return ", ".join(buckets)
+
+
+PROFILE_STATS = {}
+profile_state = threading.local()
+
+
+def profiled(f):
+    '''
+    Record calls of the decorated function in PROFILE_STATS: count,
+    total time (recursive calls are counted once), self time (without
+    calls of other profiled functions) and a histogram of call times.
+    Nothing is formatted while recording, see dump_stats.
+
+    To turn profiling off:
+
+    >>> profiled = disable
+
+    '''
+    name = "{}.{}".format(f.__module__, f.__name__)
+    stats = PROFILE_STATS.setdefault(name, CallStats(name))
+    frexp = math.frexp
+
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        try:
+            stack = profile_state.stack
+            depth = profile_state.depth
+        except AttributeError:
+            stack = profile_state.stack = []
+            depth = profile_state.depth = {}
+        level = depth.get(name, 0)
+        depth[name] = level + 1
+        # Time spent in nested profiled calls
+        stack.append(0.)
+        started = perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            elapsed = perf_counter() - started
+            children = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            depth[name] = level
+            exponent = frexp(elapsed)[1] if elapsed > 0 else ZERO_TIME
+            with stats.lock:
+                stats.calls += 1
+                stats.self_time += elapsed - children
+                if not level:
+                    stats.total_time += elapsed
+                stats.histogram[exponent] = stats.histogram.get(exponent, 0) + 1
+    return wrapper
+
+
+def dump_stats(stream=None, sort='self_time'):
+    '''Print PROFILE_STATS sorted by sort (descending) to stream (stderr).'''
+    stream = sys.stderr if stream is None else stream
+    stats = sorted((s for s in PROFILE_STATS.itervalues() if s.calls),
+                   key=lambda s: getattr(s, sort), reverse=True)
+    stream.write("{:>40} {:>10} {:>12} {:>12} {:>12}\n".format(
+        "function", "calls", "total, s", "self, s", "per call, s"))
+    for s in stats:
+        stream.write("{:>40} {:>10} {:>12.6f} {:>12.6f} {:>12.6f}\n".format(
+            s.name, s.calls, s.total_time, s.self_time, s.total_time / s.calls))
+        stream.write("{:>40} {}\n".format("", s.format_histogram()))
+
+
+def reset_stats():
+    for stats in PROFILE_STATS.itervalues():
+        stats.reset()
+
+
+def dump_stats_at_exit(stream=None, sort='self_time'):
+    atexit.register(dump_stats, stream, sort)
+
+
 @memo
 @countcalls
 @n_ary
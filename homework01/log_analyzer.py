@@ -4,12 +4,26 @@ import json
 import logging
 import datetime
 import re
-import gzip
-import collections
-import statistics
+import zlib
+import io
+import shutil
+import subprocess
+import mmap
+import bisect
+import math
+import array
 import string
 import os
-from typing import NamedTuple, Union, Optional, List, Dict, Any, cast
+import multiprocessing
+import itertools
+import pickle
+import time
+import heapq
+import struct
+import sys
+import abc
+import contextlib
+from typing import NamedTuple, Union, Optional, List, Dict, Tuple, Iterable, Iterator, Sequence, Callable, Any, BinaryIO, cast
 
 default_config = {
     "REPORT_SIZE": 1000,
@@ -17,9 +31,31 @@ default_config = {
     "LOG_DIR": "./log",
     "LOG_FILE": None,
     "ERRORS_TRESHOLD": 0.01,
+    "ERRORS_MIN_SAMPLE": 10000,
     "TS_FILE": "./log_analyzer.ts",
+    "WORKERS": 1,
+    "AGGREGATION": "exact",
+    "CHECKPOINT_INTERVAL": 0,
+    "STRIP_QUERY": False,
+    "COLLAPSE_IDS": False,
+    "MAX_URLS": 0,
+    "USE_MMAP": False,
+    "CACHE_DIR": None,
+    "TIME_SERIES": None,
 }
 
+# Относительная точность медианы в приближенном режиме агрегации
+SKETCH_RELATIVE_ACCURACY = 0.01
+# Число стандартных отклонений, при котором доля ошибок считается
+# достоверно превышающей порог
+ERRORS_Z_SCORE = 3.
+# Длина префикса $time_local ("29/Jun/2017:03:50:22 +0300"), по которому
+# запросы раскладываются по интервалам времени
+TIME_BUCKET_WIDTHS = {"minute": 17, "hour": 14}
+TIME_BUCKET_FORMATS = {"minute": "%d/%b/%Y:%H:%M", "hour": "%d/%b/%Y:%H"}
+# URL, в который сливаются редкие URL при превышении MAX_URLS
+OTHER_URL = "other"
+
 log_pattern = re.compile(
     r"(?P<remote_addr>[\d\.]+)\s"
     r"(?P<remote_user>\S*)\s+"
@@ -36,9 +72,27 @@ log_pattern = re.compile(
     r"(?P<request_time>\d+\.\d+)\s*"
 )
 
+id_segment_pattern = re.compile(r"/\d+(?=/|$)")
+
+logfile_pattern = re.compile(r"^nginx-access-ui\.log-(\d{8})(\.gz)?$")
+
+bytes_log_pattern = re.compile(log_pattern.pattern.encode())
+
 Config  = Dict[str, Any]
 Log = NamedTuple('Log', [('path', pathlib.Path), ('date', datetime.date), ('ext', str)])
 Request = NamedTuple('Request', [('url', str), ('request_time', float)])
+UrlStat = NamedTuple('UrlStat', [
+    ('url', str), ('count', int), ('time_sum', float),
+    ('time_avg', float), ('time_max', float), ('time_med', float),
+    ('time_p90', float), ('time_p95', float), ('time_p99', float)])
+
+# Квантили времени запроса в отчете: медиана, p90, p95, p99
+REPORT_QUANTILES = (0.5, 0.9, 0.95, 0.99)
+Statistics = List[Dict[str, Union[str, float]]]
+Settings = NamedTuple('Settings', [
+    ('aggregation', str), ('strip_query', bool), ('collapse_ids', bool), ('max_urls', int),
+    ('time_series', Optional[str])])
+Series = Dict[str, Any]
 
 def update_ts(ts_file: pathlib.Path) -> None:
     now = datetime.datetime.now()
@@ -46,12 +100,40 @@ def update_ts(ts_file: pathlib.Path) -> None:
     ts_file.write_text(str(timestamp))
     os.utime(ts_file.absolute(), times=(timestamp, timestamp))
 
-def create_report(template_path: pathlib.Path, destination_path: pathlib.Path, log_statistics: List[Dict[str, Union[str, float]]]) -> None:
+def split_template(template: str, name: str, **mapping: str) -> Tuple[str, str]:
+    """Делит шаблон по первому вхождению $name (${name}), остальные
+    подстановки в частях шаблона делаются как в safe_substitute(mapping)"""
+    for m in string.Template.pattern.finditer(template):
+        if name in (m.group('named'), m.group('braced')):
+            prefix = string.Template(template[:m.start()]).safe_substitute(mapping)
+            suffix = string.Template(template[m.end():]).safe_substitute(mapping)
+            return prefix, suffix
+    raise ValueError(f"В шаблоне нет подстановки ${name}")
+
+def create_report(template_path: pathlib.Path, destination_path: pathlib.Path, log_statistics: Iterable[Dict[str, Union[str, float]]],
+                  series: Optional[Series] = None) -> None:
     with template_path.open() as f:
-        template = string.Template(f.read())
-    report = template.safe_substitute(table_json=json.dumps(log_statistics))
-    with destination_path.open(mode='w') as f:
-        f.write(report)
+        prefix, suffix = split_template(f.read(), 'table_json', series_json=json.dumps(series))
+    
+    # Отчет пишется во временный файл и переименовывается только целиком,
+    # чтобы недописанный отчет не считался готовым при следующем запуске
+    tmp_path = destination_path.with_name(f'.{destination_path.name}.tmp')
+    try:
+        with tmp_path.open(mode='w') as f:
+            f.write(prefix)
+            f.write('[')
+            for i, row in enumerate(log_statistics):
+                if i:
+                    f.write(', ')
+                f.write(json.dumps(row))
+            f.write(']')
+            f.write(suffix)
+        os.replace(str(tmp_path), str(destination_path))
+    except BaseException:
+        # Временный файл мог быть не создан, тогда важна исходная ошибка
+        with contextlib.suppress(FileNotFoundError):
+            tmp_path.unlink()
+        raise
 
 def process_line(line: str) -> Optional[Request]:
     m = log_pattern.match(line)
@@ -67,48 +149,909 @@ def process_line(line: str) -> Optional[Request]:
     else:
         return Request(url, request_time)
 
-def process_log(log: Log, errors_treshold: float) -> List[Dict[str, Union[str, float]]]:
-    if log.ext == '.gz':
-        f = gzip.open(log.path.absolute(), mode='rt')
-    else:
-        f = log.path.open()
+def process_line_bytes(line: bytes) -> Optional[Request]:
+    """process_line для строки в байтах: декодируется только URL"""
+    m = bytes_log_pattern.match(line)
+    if not m:
+        return None
     
+    try:
+        method, url, protocol = m.group('request').split()
+        request_time = float(m.group('request_time'))
+    except (ValueError, TypeError):
+        return None
+    else:
+        return Request(url.decode(errors='replace'), request_time)
+
+def fast_process_line(line: bytes) -> Optional[Request]:
+    """Разбирает только запрос и время запроса строки формата ui,
+    не строя groupdict() по всем полям и декодируя только URL.
+
+    Без регулярного выражения принимаются только строки в каноническом
+    виде: ровно 12 кавычек, поля "адрес пользователь  ip [время] "
+    в начале, числовой статус, поля в кавычках через один пробел и время
+    запроса в конце. На таких строках результат совпадает с log_pattern,
+    все остальные разбираются полным регулярным выражением."""
+    fields = line.split(b'"')
+    if len(fields) != 13:
+        return process_line_bytes(line)
+
+    head, bracket, time_local = fields[0].partition(b' [')
+    head_fields = head.split(b' ')
+    status_fields = fields[2].split(b' ')
+    if not (bracket and time_local.endswith(b'] ')
+            and len(head_fields) == 4 and not head_fields[2]
+            and head.split() == [head_fields[0], head_fields[1], head_fields[3]]
+            and not head_fields[0].strip(b'0123456789.')
+            and len(status_fields) == 4 and not status_fields[0] and not status_fields[3]
+            and fields[2].split() == status_fields[1:3] and status_fields[1].isdigit()
+            and fields[4] == fields[6] == fields[8] == fields[10] == b' '
+            and fields[12][:1] == b' ' and line.find(b'\n', 0, len(line) - len(fields[12])) < 0):
+        return process_line_bytes(line)
+
+    request_time = fields[12][1:].rstrip()
+    seconds, dot, fraction = request_time.partition(b'.')
+    if not (dot and seconds.isdigit() and fraction.isdigit()):
+        return process_line_bytes(line)
+    parts = fields[1].split()
+    if len(parts) != 3:
+        return None
+    return Request(parts[1].decode(errors='replace'), float(request_time))
+
+def normalize_url(url: str, strip_query: bool = True, collapse_ids: bool = True) -> str:
+    """Приводит URL к шаблону: отбрасывает параметры запроса
+    и заменяет числовые сегменты пути на {id}"""
+    path, question, query = url.partition('?')
+    if collapse_ids:
+        path = id_segment_pattern.sub('/{id}', path)
+    if strip_query:
+        return path
+    return path + question + query
+
+def interpolate_quantile(value_at: Callable[[int], float], n: int, q: float) -> float:
+    """Квантиль q выборки из n значений по функции value_at(rank), возвращающей
+    значение с данным рангом. Как и statistics.median, интерполирует между
+    соседними по рангу значениями."""
+    rank = q * (n - 1)
+    lower = math.floor(rank)
+    value = value_at(lower)
+    if rank > lower:
+        fraction = rank - lower
+        value = value * (1 - fraction) + value_at(lower + 1) * fraction
+    return value
+
+class QuantileSketch:
+    """Квантильный скетч с ограниченной относительной ошибкой (DDSketch).
+
+    Значения раскладываются по логарифмическим корзинам, поэтому число
+    корзин зависит только от диапазона значений, а не от их количества.
+    Скетчи можно объединять без потери точности. Помимо корзин хранятся
+    точные количество, сумма и максимум значений.
+    """
+
+    __slots__ = ('gamma_log', 'bins', 'zero_count', 'count', 'total', 'max')
+
+    # Значения меньше этого порога попадают в "нулевую" корзину
+    min_value = 1e-9
+
+    def __init__(self, relative_accuracy: float = SKETCH_RELATIVE_ACCURACY) -> None:
+        gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.gamma_log = math.log(gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if value < self.min_value:
+            self.zero_count += 1
+            return
+        index = math.ceil(math.log(value) / self.gamma_log)
+        self.bins[index] = self.bins.get(index, 0) + 1
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        self.zero_count += other.zero_count
+        for index, count in other.bins.items():
+            self.bins[index] = self.bins.get(index, 0) + count
+
+    def quantile(self, q: float) -> float:
+        return self.quantiles([q])[0]
+
+    def quantiles(self, qs: Sequence[float]) -> List[float]:
+        """Квантили qs за один проход сортировки корзин"""
+        indexes = sorted(self.bins)
+        cumulative = list(itertools.accumulate(self.bins[index] for index in indexes))
+        gamma = math.exp(self.gamma_log)
+
+        def value_at(rank: int) -> float:
+            if rank < self.zero_count:
+                return 0.
+            position = bisect.bisect_right(cumulative, rank - self.zero_count)
+            if position == len(indexes):
+                return self.max
+            # Середина корзины (gamma^(i-1), gamma^i] с точки зрения относительной ошибки
+            return min(2 * gamma ** indexes[position] / (gamma + 1), self.max)
+
+        return [interpolate_quantile(value_at, self.count, q) for q in qs]
+
+
+def add_to_bucket(buckets: Dict[bytes, List[float]], bucket: bytes, request_time: float) -> None:
+    stat = buckets.get(bucket)
+    if stat is None:
+        buckets[bucket] = [1, request_time, request_time]
+    else:
+        stat[0] += 1
+        stat[1] += request_time
+        if request_time > stat[2]:
+            stat[2] = request_time
+
+def merge_buckets(buckets: Dict[bytes, List[float]], other: Dict[bytes, List[float]]) -> None:
+    for bucket, (count, time_sum, time_max) in other.items():
+        stat = buckets.get(bucket)
+        if stat is None:
+            buckets[bucket] = [count, time_sum, time_max]
+        else:
+            stat[0] += count
+            stat[1] += time_sum
+            stat[2] = max(stat[2], time_max)
+
+
+class TimeSeries:
+    """Число запросов, суммарное и максимальное время запросов по интервалам
+    времени по всему логу.
+
+    Интервал задается префиксом $time_local нужной длины (байты строки
+    лога как есть), в даты ключи переводятся только при выводе.
+    """
+
+    def __init__(self, resolution: str) -> None:
+        self.resolution = resolution
+        self.total: Dict[bytes, List[float]] = {}
+
+    def add(self, bucket: bytes, request_time: float) -> None:
+        add_to_bucket(self.total, bucket, request_time)
+
+    def merge(self, other: 'TimeSeries') -> None:
+        merge_buckets(self.total, other.total)
+
+    def rows(self, buckets: Dict[bytes, List[float]]) -> List[Dict[str, Union[str, float]]]:
+        time_format = TIME_BUCKET_FORMATS[self.resolution]
+        rows = []
+        for bucket, (count, time_sum, time_max) in buckets.items():
+            label = bucket.decode(errors='replace')
+            try:
+                moment = datetime.datetime.strptime(label, time_format)
+            except ValueError:
+                continue
+            row: Dict[str, Union[str, float]] = {
+                'time': moment.isoformat(timespec='minutes'),
+                'count': count,
+                'time_sum': round(time_sum, 3),
+                'time_max': round(time_max, 3),
+            }
+            rows.append((moment, row))
+        return [row for _, row in sorted(rows, key=lambda r: r[0])]
+
+    def to_json(self) -> Series:
+        return {
+            'resolution': self.resolution,
+            'total': self.rows(self.total),
+        }
+
+
+class Aggregator(abc.ABC):
+    """Агрегирует времена запросов по URL.
+
+    Если задан max_urls, число различных URL ограничено: при его достижении
+    самые редкие URL сливаются в OTHER_URL. URL, встретившийся после
+    слияния снова, учитывается заново.
+
+    Если задан time_series, в series дополнительно собираются ряды по
+    интервалам времени (заполняются при обработке строк).
+    """
+
+    def __init__(self, max_urls: int = 0, time_series: Optional[str] = None) -> None:
+        self.max_urls = max_urls
+        self.series = TimeSeries(time_series) if time_series else None
+
+    @abc.abstractmethod
+    def add(self, url: str, request_time: float) -> None:
+        pass
+
+    @abc.abstractmethod
+    def merge(self, other: 'Aggregator') -> None:
+        pass
+
+    @abc.abstractmethod
+    def totals(self) -> Tuple[int, float]:
+        pass
+
+    @abc.abstractmethod
+    def url_totals(self) -> Iterator[Tuple[str, float]]:
+        """Суммарное время запросов по каждому URL"""
+
+    @abc.abstractmethod
+    def url_stat(self, url: str) -> UrlStat:
+        pass
+
+    @abc.abstractmethod
+    def __len__(self) -> int:
+        pass
+
+    def is_full(self) -> bool:
+        return self.max_urls > 0 and len(self) >= self.max_urls
+
+    def rare_urls(self, counts: Iterable[Tuple[str, int]]) -> List[str]:
+        """URL, которые нужно слить в OTHER_URL, чтобы их осталось вдвое меньше max_urls"""
+        n_spilled = len(self) - max(self.max_urls // 2, 1)
+        counts = ((url, count) for url, count in counts if url != OTHER_URL)
+        return [url for url, _ in heapq.nsmallest(n_spilled, counts, key=lambda c: c[1])]
+
+    def merge_series(self, other: 'Aggregator') -> None:
+        if self.series is not None and other.series is not None:
+            self.series.merge(other.series)
+
+
+class ExactAggregator(Aggregator):
+    """Хранит все времена запросов, медиана считается точно.
+
+    Времена хранятся в array('d') (8 байт на значение вместо ~32 байт
+    на float в списке), а сумма, максимум и медиана считаются встроенными
+    функциями над всем буфером сразу.
+    """
+
+    def __init__(self, max_urls: int = 0, time_series: Optional[str] = None) -> None:
+        super().__init__(max_urls, time_series)
+        self.url2times: Dict[str, array.array] = {}
+
+    def add(self, url: str, request_time: float) -> None:
+        request_times = self.url2times.get(url)
+        if request_times is None:
+            if self.is_full():
+                self.compact()
+            request_times = self.url2times[url] = array.array('d')
+        request_times.append(request_time)
+
+    def merge(self, other: Aggregator) -> None:
+        for url, other_times in cast(ExactAggregator, other).url2times.items():
+            request_times = self.url2times.get(url)
+            if request_times is None:
+                self.url2times[url] = other_times
+            else:
+                request_times.extend(other_times)
+        self.merge_series(other)
+        if self.is_full():
+            self.compact()
+
+    def compact(self) -> None:
+        rare = self.rare_urls((url, len(times)) for url, times in self.url2times.items())
+        other_times = self.url2times.pop(OTHER_URL, array.array('d'))
+        for url in rare:
+            other_times.extend(self.url2times.pop(url))
+        self.url2times[OTHER_URL] = other_times
+
+    def totals(self) -> Tuple[int, float]:
+        total_count = 0
+        total_time = 0.
+        for request_times in self.url2times.values():
+            total_count += len(request_times)
+            total_time  += sum(request_times)
+        return total_count, total_time
+
+    def url_totals(self) -> Iterator[Tuple[str, float]]:
+        for url, request_times in self.url2times.items():
+            yield url, sum(request_times)
+
+    def url_stat(self, url: str) -> UrlStat:
+        request_times = self.url2times[url]
+        count = len(request_times)
+        time_sum = sum(request_times)
+        # Одна сортировка на все квантили
+        sorted_times = sorted(request_times)
+        quantiles = [interpolate_quantile(sorted_times.__getitem__, count, q) for q in REPORT_QUANTILES]
+        return UrlStat(url, count, time_sum,
+            time_sum / count,
+            sorted_times[-1],
+            *quantiles)
+
+    def __len__(self) -> int:
+        return len(self.url2times)
+
+
+class ApproximateAggregator(Aggregator):
+    """Хранит для каждого URL только квантильный скетч, медиана приближенная"""
+
+    def __init__(self, max_urls: int = 0, time_series: Optional[str] = None) -> None:
+        super().__init__(max_urls, time_series)
+        self.url2sketch: Dict[str, QuantileSketch] = {}
+
+    def add(self, url: str, request_time: float) -> None:
+        sketch = self.url2sketch.get(url)
+        if sketch is None:
+            if self.is_full():
+                self.compact()
+            sketch = self.url2sketch[url] = QuantileSketch()
+        sketch.add(request_time)
+
+    def merge(self, other: Aggregator) -> None:
+        for url, other_sketch in cast(ApproximateAggregator, other).url2sketch.items():
+            sketch = self.url2sketch.get(url)
+            if sketch is None:
+                self.url2sketch[url] = other_sketch
+            else:
+                sketch.merge(other_sketch)
+        self.merge_series(other)
+        if self.is_full():
+            self.compact()
+
+    def compact(self) -> None:
+        rare = self.rare_urls((url, sketch.count) for url, sketch in self.url2sketch.items())
+        other_sketch = self.url2sketch.pop(OTHER_URL, None) or QuantileSketch()
+        for url in rare:
+            other_sketch.merge(self.url2sketch.pop(url))
+        self.url2sketch[OTHER_URL] = other_sketch
+
+    def totals(self) -> Tuple[int, float]:
+        total_count = 0
+        total_time = 0.
+        for sketch in self.url2sketch.values():
+            total_count += sketch.count
+            total_time  += sketch.total
+        return total_count, total_time
+
+    def url_totals(self) -> Iterator[Tuple[str, float]]:
+        for url, sketch in self.url2sketch.items():
+            yield url, sketch.total
+
+    def url_stat(self, url: str) -> UrlStat:
+        sketch = self.url2sketch[url]
+        return UrlStat(url, sketch.count, sketch.total,
+            sketch.total / sketch.count,
+            sketch.max,
+            *sketch.quantiles(REPORT_QUANTILES))
+
+    def __len__(self) -> int:
+        return len(self.url2sketch)
+
+
+AGGREGATORS = {
+    "exact": ExactAggregator,
+    "approx": ApproximateAggregator,
+}
+
+class ErrorBudget:
+    """Следит за долей неразобранных строк по ходу обработки.
+
+    Сохраняет несколько неразобранных строк для сообщения об ошибке и,
+    если задан min_sample, прерывает обработку, как только нижняя граница
+    доверительного интервала Уилсона для доли ошибок превысит порог.
+    """
+
+    max_samples = 5
+
+    def __init__(self, treshold: float, min_sample: Optional[int] = None) -> None:
+        self.treshold = treshold
+        self.min_sample = min_sample
+        self.samples: List[str] = []
+
+    def fail(self, line: bytes, n_loglines: int, n_fails: int) -> None:
+        if len(self.samples) < self.max_samples:
+            self.samples.append(line[:200].decode(errors='replace').rstrip())
+        if self.min_sample is None or n_loglines < self.min_sample:
+            return
+        lower_bound = wilson_lower_bound(n_fails, n_loglines, ERRORS_Z_SCORE)
+        if lower_bound > self.treshold:
+            raise Exception(f"Обработка прервана после {n_loglines} строк: доля ошибок {n_fails / n_loglines} "
+                            f"достоверно превышает {self.treshold}. {self.format_samples()}")
+
+    def format_samples(self) -> str:
+        return "Примеры неразобранных строк: " + "; ".join(repr(sample) for sample in self.samples)
+
+
+def wilson_lower_bound(n_success: int, n: int, z: float) -> float:
+    p = n_success / n
+    z2 = z * z
+    center = p + z2 / (2 * n)
+    spread = z * math.sqrt(p * (1 - p) / n + z2 / (4 * n * n))
+    return (center - spread) / (1 + z2 / n)
+
+Aggregate = Tuple[int, int, Aggregator]
+# Контрольная точка: агрегат строк лога до offset и размер файла контрольной
+# точки, до которого его записи прочитались целиком
+Checkpoint = NamedTuple('Checkpoint', [
+    ('log_path', str), ('settings', Settings), ('offset', int), ('aggregate', Aggregate), ('size', int)])
+
+default_settings = Settings("exact", False, False, 0, None)
+
+def make_aggregator(settings: Settings) -> Aggregator:
+    return AGGREGATORS[settings.aggregation](settings.max_urls, settings.time_series)
+
+def process_lines(lines: Iterable[bytes], settings: Settings = default_settings, aggregate: Optional[Aggregate] = None,
+                  errors: Optional[ErrorBudget] = None) -> Aggregate:
+    if aggregate is None:
+        n_loglines, n_fails, aggregator = 0, 0, make_aggregator(settings)
+    else:
+        n_loglines, n_fails, aggregator = aggregate
+    strip_query, collapse_ids = settings.strip_query, settings.collapse_ids
+    normalize = strip_query or collapse_ids
+    series = aggregator.series
+    bucket_width = TIME_BUCKET_WIDTHS[series.resolution] if series else 0
+    for line in lines:
+        n_loglines += 1
+        request = fast_process_line(line)
+        if not request:
+            n_fails += 1
+            if errors:
+                errors.fail(line, n_loglines, n_fails)
+            continue
+        url = normalize_url(request.url, strip_query, collapse_ids) if normalize else request.url
+        aggregator.add(url, request.request_time)
+        if series:
+            # Интервал берется срезом $time_local без разбора даты
+            bucket_start = line.find(b'[') + 1
+            series.add(line[bucket_start:bucket_start + bucket_width], request.request_time)
+    return n_loglines, n_fails, aggregator
+
+ParsedLog = NamedTuple('ParsedLog', [
+    ('n_loglines', int), ('n_fails', int), ('urls', List[str]), ('buckets', List[bytes]),
+    ('url_ids', array.array), ('bucket_ids', array.array), ('request_times', array.array)])
+
+def parse_lines(lines: Iterable[bytes], errors: Optional[ErrorBudget] = None) -> ParsedLog:
+    """Разбирает строки в колонки (url_id, bucket_id, request_time) и словари
+    URL и поминутных интервалов времени"""
     n_loglines = 0
     n_fails = 0
-    url2times: Dict[str, List[float]] = collections.defaultdict(list)
-    with f:
-        for line in f:
-            n_loglines += 1
-            request = process_line(line)
-            if not request:
-                n_fails += 1
+    url2id: Dict[str, int] = {}
+    bucket2id: Dict[bytes, int] = {}
+    url_ids = array.array('I')
+    bucket_ids = array.array('I')
+    request_times = array.array('d')
+    bucket_width = TIME_BUCKET_WIDTHS["minute"]
+    for line in lines:
+        n_loglines += 1
+        request = fast_process_line(line)
+        if not request:
+            n_fails += 1
+            if errors:
+                errors.fail(line, n_loglines, n_fails)
+            continue
+        url_id = url2id.get(request.url)
+        if url_id is None:
+            url_id = url2id[request.url] = len(url2id)
+        bucket_start = line.find(b'[') + 1
+        bucket = line[bucket_start:bucket_start + bucket_width]
+        bucket_id = bucket2id.get(bucket)
+        if bucket_id is None:
+            bucket_id = bucket2id[bucket] = len(bucket2id)
+        url_ids.append(url_id)
+        bucket_ids.append(bucket_id)
+        request_times.append(request.request_time)
+    return ParsedLog(n_loglines, n_fails, list(url2id), list(bucket2id), url_ids, bucket_ids, request_times)
+
+def merge_parsed(parts: Iterable[ParsedLog]) -> ParsedLog:
+    n_loglines = 0
+    n_fails = 0
+    url2id: Dict[str, int] = {}
+    bucket2id: Dict[bytes, int] = {}
+    url_ids = array.array('I')
+    bucket_ids = array.array('I')
+    request_times = array.array('d')
+    for part in parts:
+        n_loglines += part.n_loglines
+        n_fails += part.n_fails
+        url_remap = [url2id.setdefault(url, len(url2id)) for url in part.urls]
+        url_ids.extend(url_remap[url_id] for url_id in part.url_ids)
+        bucket_remap = [bucket2id.setdefault(bucket, len(bucket2id)) for bucket in part.buckets]
+        bucket_ids.extend(bucket_remap[bucket_id] for bucket_id in part.bucket_ids)
+        request_times.extend(part.request_times)
+    return ParsedLog(n_loglines, n_fails, list(url2id), list(bucket2id), url_ids, bucket_ids, request_times)
+
+def aggregate_parsed(parsed: ParsedLog, settings: Settings = default_settings) -> Aggregate:
+    aggregator = make_aggregator(settings)
+    urls = parsed.urls
+    if settings.strip_query or settings.collapse_ids:
+        # Нормализуется каждый различный URL, а не каждая строка
+        urls = [normalize_url(url, settings.strip_query, settings.collapse_ids) for url in urls]
+    add = aggregator.add
+    for url_id, request_time in zip(parsed.url_ids, parsed.request_times):
+        add(urls[url_id], request_time)
+    
+    series = aggregator.series
+    if series:
+        bucket_width = TIME_BUCKET_WIDTHS[series.resolution]
+        buckets = [bucket[:bucket_width] for bucket in parsed.buckets]
+        for bucket_id, request_time in zip(parsed.bucket_ids, parsed.request_times):
+            series.add(buckets[bucket_id], request_time)
+    return parsed.n_loglines, parsed.n_fails, aggregator
+
+def get_chunks(path: pathlib.Path, n_chunks: int) -> List[Tuple[int, int]]:
+    """Разбивает файл на n_chunks диапазонов байт, выровненных по границам строк"""
+    size = path.stat().st_size
+    bounds = [0]
+    with path.open(mode='rb') as f:
+        for i in range(1, n_chunks):
+            offset = size * i // n_chunks
+            if offset <= bounds[-1]:
                 continue
-            url2times[request.url].append(request.request_time)
-
-    errors = n_fails / n_loglines
-    if errors > errors_treshold:
-        raise Exception(f"Доля ошибок {errors} превышает {errors_treshold}")
-
-    total_count = 0
-    total_time = 0.
-    for request_times in url2times.values():
-        total_count += len(request_times)
-        total_time  += sum(request_times)
-    
-    stat = []
-    for url, request_times in url2times.items():
-        stat.append({
-            'url': url,
-            'count': len(request_times),
-            'count_perc': round(100. * len(request_times) / float(total_count), 3),
-            'time_sum': round(sum(request_times), 3),
-            'time_perc': round(100. * sum(request_times) / total_time, 3),
-            'time_avg': round(statistics.mean(request_times), 3),
-            'time_max': round(max(request_times), 3),
-            "time_med": round(statistics.median(request_times), 3),
-        })
-    
-    return stat # type: ignore
+            f.seek(offset - 1)
+            f.readline()
+            offset = f.tell()
+            if bounds[-1] < offset < size:
+                bounds.append(offset)
+    bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+def read_mmap_lines(path: pathlib.Path, start: int = 0, end: Optional[int] = None) -> Iterator[bytes]:
+    """Читает строки, начинающиеся в [start, end), из отображенного в память
+    файла. Страницы файла не копируются в буферы процесса и вытесняются
+    ядром по мере чтения, поэтому RSS не зависит от размера файла."""
+    with path.open(mode='rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            if hasattr(buffer, 'madvise'):
+                buffer.madvise(mmap.MADV_SEQUENTIAL)
+            find = buffer.find
+            position = start
+            while position < end:
+                newline = find(b'\n', position)
+                if newline < 0:
+                    newline = size - 1
+                yield buffer[position:newline + 1]
+                position = newline + 1
+
+def read_chunk(path: pathlib.Path, start: int, end: int, use_mmap: bool = False) -> Iterator[bytes]:
+    if use_mmap:
+        yield from read_mmap_lines(path, start, end)
+        return
+
+    with path.open(mode='rb') as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            yield line
+
+def process_chunk(path: pathlib.Path, start: int, end: int, settings: Settings = default_settings,
+                  use_mmap: bool = False, errors: Optional[ErrorBudget] = None) -> Tuple[Aggregate, List[str]]:
+    errors = errors or ErrorBudget(1.)
+    return process_lines(read_chunk(path, start, end, use_mmap), settings, errors=errors), errors.samples
+
+def parse_chunk(path: pathlib.Path, start: int, end: int, use_mmap: bool = False,
+                errors: Optional[ErrorBudget] = None) -> Tuple[ParsedLog, List[str]]:
+    errors = errors or ErrorBudget(1.)
+    return parse_lines(read_chunk(path, start, end, use_mmap), errors), errors.samples
+
+def map_chunks(func: Any, path: pathlib.Path, workers: int, args: Tuple, errors: ErrorBudget) -> List[Any]:
+    """Применяет func к диапазонам файла в пуле процессов, собирая
+    примеры неразобранных строк в errors"""
+    chunks = get_chunks(path, workers)
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.starmap(func, [(path, start, end) + args + (errors,) for start, end in chunks])
+    for _, samples in results:
+        errors.samples.extend(samples[:errors.max_samples - len(errors.samples)])
+    return [result for result, _ in results]
+
+def merge_aggregates(aggregates: Iterable[Aggregate]) -> Aggregate:
+    n_loglines = 0
+    n_fails = 0
+    aggregator = None
+    for chunk_loglines, chunk_fails, chunk_aggregator in aggregates:
+        n_loglines += chunk_loglines
+        n_fails += chunk_fails
+        if aggregator is None:
+            aggregator = chunk_aggregator
+        else:
+            aggregator.merge(chunk_aggregator)
+    return n_loglines, n_fails, cast(Aggregator, aggregator)
+
+def get_checkpoint_path(ts_path: pathlib.Path) -> pathlib.Path:
+    return ts_path.with_name(ts_path.name + '.checkpoint')
+
+# Файл контрольной точки дописывается: в начале путь лога и настройки
+# агрегации, дальше после каждой пачки строк - ее конец в логе, число строк
+# и ошибок в ней и ее агрегат. Поэтому объем записи растет линейно с логом,
+# а не пересохраняется весь агрегат
+
+def load_checkpoint(checkpoint_path: pathlib.Path, log: Log, settings: Settings) -> Optional[Checkpoint]:
+    if not checkpoint_path.exists():
+        return None
+    
+    with checkpoint_path.open(mode='rb') as f:
+        try:
+            log_path, checkpoint_settings = pickle.load(f)
+        except Exception:
+            return None
+        # Контрольная точка от другого лога или с другими настройками агрегации не подходит
+        if log_path != str(log.path.absolute()) or checkpoint_settings != settings:
+            return None
+        
+        offset = 0
+        aggregates = []
+        size = f.tell()
+        while True:
+            # Последняя запись может быть недописана, если запуск был прерван
+            try:
+                offset, n_loglines, n_fails, aggregator = pickle.load(f)
+            except Exception:
+                break
+            aggregates.append((n_loglines, n_fails, aggregator))
+            size = f.tell()
+    
+    # Точка за концом файла не подходит (например, лог был перезаписан)
+    if not aggregates or (log.ext != '.gz' and offset > log.path.stat().st_size):
+        return None
+    return Checkpoint(log_path, settings, offset, merge_aggregates(aggregates), size)
+
+def open_checkpoint(checkpoint_path: pathlib.Path, log: Log, settings: Settings,
+                    checkpoint: Optional[Checkpoint]) -> BinaryIO:
+    """Открывает файл контрольной точки для дописывания: после прочитанных
+    записей checkpoint или заново, если ее нет"""
+    f: BinaryIO
+    if checkpoint:
+        f = checkpoint_path.open(mode='r+b')
+        f.truncate(checkpoint.size)
+        f.seek(checkpoint.size)
+        return f
+    f = checkpoint_path.open(mode='wb')
+    pickle.dump((str(log.path.absolute()), settings), f, protocol=pickle.HIGHEST_PROTOCOL)
+    return f
+
+def save_checkpoint(f: BinaryIO, offset: int, aggregate: Aggregate) -> None:
+    pickle.dump((offset,) + aggregate, f, protocol=pickle.HIGHEST_PROTOCOL)
+    f.flush()
+
+# Размер блока, которым читаются и распаковываются логи
+READ_BLOCK_SIZE = 1 << 20
+
+def read_gzip_blocks(path: pathlib.Path) -> Iterator[bytes]:
+    """Распаковывает gzip большими блоками: через pigz, если он установлен,
+    иначе через zlib в текущем процессе"""
+    pigz = shutil.which('pigz')
+    if pigz:
+        with subprocess.Popen([pigz, '-dc', str(path)], stdout=subprocess.PIPE) as proc:
+            stdout = cast(BinaryIO, proc.stdout)
+            for block in iter(lambda: stdout.read(READ_BLOCK_SIZE), b''):
+                yield block
+        if proc.returncode:
+            raise Exception(f"pigz завершился с кодом {proc.returncode}")
+        return
+
+    with path.open(mode='rb') as f:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # Начат ли текущий gzip-поток: недописанный поток - ошибка, как в gzip.open
+        started = False
+        for block in iter(lambda: f.read(READ_BLOCK_SIZE), b''):
+            while block:
+                started = True
+                yield decompressor.decompress(block)
+                if not decompressor.eof:
+                    break
+                # Файл может состоять из нескольких gzip-потоков
+                block = decompressor.unused_data
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                started = False
+        yield decompressor.flush()
+        if started and not decompressor.eof:
+            raise EOFError(f"Архив '{path}' обрывается до конца gzip-потока")
+
+def split_lines(blocks: Iterable[bytes], offset: int = 0) -> Iterator[bytes]:
+    """Собирает строки из блоков байт, пропуская первые offset байт"""
+    rest = b''
+    for block in blocks:
+        if offset:
+            skip = min(offset, len(block))
+            block = block[skip:]
+            offset -= skip
+        block = rest + block
+        cut = block.rfind(b'\n') + 1
+        rest = block[cut:]
+        if cut:
+            yield from io.BytesIO(block[:cut])
+    if rest:
+        yield rest
+
+def read_lines(log: Log, offset: int = 0, use_mmap: bool = False) -> Iterator[bytes]:
+    if log.ext == '.gz':
+        yield from split_lines(read_gzip_blocks(log.path), offset)
+        return
+    if use_mmap:
+        yield from read_mmap_lines(log.path, offset)
+        return
+
+    with log.path.open(mode='rb') as f:
+        f.seek(offset)
+        yield from f
+
+def process_file(log: Log, settings: Settings, checkpoint_path: Optional[pathlib.Path], checkpoint_interval: int,
+                 use_mmap: bool = False, errors: Optional[ErrorBudget] = None) -> Aggregate:
+    offset = 0
+    checkpoint = None
+    aggregate = None
+    if checkpoint_path:
+        checkpoint = load_checkpoint(checkpoint_path, log, settings)
+        if checkpoint:
+            logging.info(f"Продолжение обработки '{log.path}' с позиции {checkpoint.offset}")
+            offset = checkpoint.offset
+            aggregate = checkpoint.aggregate
+
+    lines = read_lines(log, offset, use_mmap)
+    if not checkpoint_path or checkpoint_interval <= 0:
+        return process_lines(lines, settings, aggregate, errors)
+
+    n_loglines, n_fails, aggregator = aggregate or (0, 0, make_aggregator(settings))
+    with open_checkpoint(checkpoint_path, log, settings, checkpoint) as f:
+        while True:
+            batch = list(itertools.islice(lines, checkpoint_interval))
+            # Последняя строка несжатого лога без перевода строки может еще
+            # дописываться: она учитывается в результате, но не в контрольной
+            # точке, поэтому следующий запуск прочитает ее заново целиком
+            partial_line = None
+            if batch and log.ext != '.gz' and not batch[-1].endswith(b'\n'):
+                partial_line = batch.pop()
+            if batch:
+                # Пачка агрегируется отдельно, чтобы в контрольную точку записать
+                # только ее, а счетчики строк идут сквозные для доли ошибок
+                batch_loglines, batch_fails, batch_aggregator = process_lines(
+                    batch, settings, (n_loglines, n_fails, make_aggregator(settings)), errors)
+                offset += sum(map(len, batch))
+                save_checkpoint(f, offset, (batch_loglines - n_loglines, batch_fails - n_fails, batch_aggregator))
+                n_loglines, n_fails = batch_loglines, batch_fails
+                aggregator.merge(batch_aggregator)
+            if partial_line is not None:
+                return process_lines([partial_line], settings, (n_loglines, n_fails, aggregator), errors)
+            if not batch:
+                return n_loglines, n_fails, aggregator
+
+def get_top_urls(aggregator: Aggregator, report_size: Optional[int] = None) -> List[str]:
+    """report_size URL с наибольшим суммарным временем запросов"""
+    # Ключ совпадает с округленным time_sum отчета, а nlargest устойчив,
+    # как и sorted, поэтому порядок URL с равным временем не меняется
+    key = lambda url_total: round(url_total[1], 3)
+    if report_size is None:
+        top = sorted(aggregator.url_totals(), key=key, reverse=True)
+    else:
+        top = heapq.nlargest(report_size, aggregator.url_totals(), key=key)
+    return [url for url, _ in top]
+
+def iter_statistics(aggregator: Aggregator, report_size: Optional[int] = None) -> Iterator[Dict[str, Union[str, float]]]:
+    """Статистика по report_size URL с наибольшим суммарным временем
+    запросов (по всем URL, если report_size не задан)"""
+    total_count, total_time = aggregator.totals()
+    for url in get_top_urls(aggregator, report_size):
+        url_stat = aggregator.url_stat(url)
+        yield {
+            'url': url_stat.url,
+            'count': url_stat.count,
+            'count_perc': round(100. * url_stat.count / float(total_count), 3),
+            'time_sum': round(url_stat.time_sum, 3),
+            'time_perc': round(100. * url_stat.time_sum / total_time, 3),
+            'time_avg': round(url_stat.time_avg, 3),
+            'time_max': round(url_stat.time_max, 3),
+            "time_med": round(url_stat.time_med, 3),
+            "time_p90": round(url_stat.time_p90, 3),
+            "time_p95": round(url_stat.time_p95, 3),
+            "time_p99": round(url_stat.time_p99, 3),
+        }
+
+# Заголовок файла с разобранным логом: сигнатура (с порядком байт колонок),
+# размер и mtime исходного лога, число строк и ошибок, размеры словарей URL
+# и интервалов времени в байтах и число записей
+PARSED_HEADER = struct.Struct('<8sQqQQQQQ')
+PARSED_MAGIC = b'LACOLS2' + sys.byteorder[0].encode()
+
+def get_parsed_path(cache_dir: pathlib.Path, log: Log) -> pathlib.Path:
+    return cache_dir / (log.path.name + '.columns')
+
+def save_parsed(parsed_path: pathlib.Path, log: Log, parsed: ParsedLog) -> None:
+    stat = log.path.stat()
+    urls = '\n'.join(parsed.urls).encode()
+    buckets = b'\n'.join(parsed.buckets)
+    tmp_path = parsed_path.with_name(parsed_path.name + '.tmp')
+    with tmp_path.open(mode='wb') as f:
+        f.write(PARSED_HEADER.pack(PARSED_MAGIC, stat.st_size, stat.st_mtime_ns,
+            parsed.n_loglines, parsed.n_fails, len(urls), len(buckets), len(parsed.url_ids)))
+        f.write(urls)
+        f.write(buckets)
+        parsed.url_ids.tofile(f)
+        parsed.bucket_ids.tofile(f)
+        parsed.request_times.tofile(f)
+    os.replace(str(tmp_path), str(parsed_path))
+
+def load_parsed(parsed_path: pathlib.Path, log: Log) -> Optional[ParsedLog]:
+    """Загружает разобранный лог, если он построен по текущей версии файла"""
+    if not parsed_path.exists():
+        return None
+    
+    stat = log.path.stat()
+    with parsed_path.open(mode='rb') as f:
+        header = f.read(PARSED_HEADER.size)
+        if len(header) < PARSED_HEADER.size:
+            return None
+        magic, size, mtime_ns, n_loglines, n_fails, urls_size, buckets_size, n_rows = PARSED_HEADER.unpack(header)
+        if magic != PARSED_MAGIC or size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            return None
+        urls = f.read(urls_size).decode().split('\n') if n_rows else []
+        buckets = f.read(buckets_size).split(b'\n') if n_rows else []
+        url_ids = array.array('I')
+        bucket_ids = array.array('I')
+        request_times = array.array('d')
+        try:
+            url_ids.fromfile(f, n_rows)
+            bucket_ids.fromfile(f, n_rows)
+            request_times.fromfile(f, n_rows)
+        except EOFError:
+            return None
+    return ParsedLog(n_loglines, n_fails, urls, buckets, url_ids, bucket_ids, request_times)
+
+def get_parsed_log(log: Log, cache_dir: pathlib.Path, workers: int = 1, use_mmap: bool = False,
+                   errors: Optional[ErrorBudget] = None) -> ParsedLog:
+    parsed_path = get_parsed_path(cache_dir, log)
+    parsed = load_parsed(parsed_path, log)
+    if parsed:
+        logging.info(f"Используется разобранный лог '{parsed_path}'")
+        return parsed
+    
+    errors = errors or ErrorBudget(1.)
+    if workers > 1 and log.ext != '.gz':
+        parsed = merge_parsed(map_chunks(parse_chunk, log.path, workers, (use_mmap,), errors))
+    else:
+        parsed = parse_lines(read_lines(log, use_mmap=use_mmap), errors)
+    save_parsed(parsed_path, log, parsed)
+    return parsed
+
+def get_statistics(aggregator: Aggregator, report_size: Optional[int] = None) -> Statistics:
+    return list(iter_statistics(aggregator, report_size))
+
+def aggregate_log(log: Log, errors_treshold: float, workers: int = 1, aggregation: str = "exact",
+                  checkpoint_path: Optional[pathlib.Path] = None, checkpoint_interval: int = 0,
+                  strip_query: bool = False, collapse_ids: bool = False,
+                  max_urls: int = 0, use_mmap: bool = False, cache_dir: Optional[pathlib.Path] = None,
+                  errors_min_sample: Optional[int] = None, time_series: Optional[str] = None) -> Aggregator:
+    if aggregation not in AGGREGATORS:
+        raise ValueError(f"Неизвестный режим агрегации '{aggregation}'")
+    if time_series is not None and time_series not in TIME_BUCKET_WIDTHS:
+        raise ValueError(f"Неизвестный интервал временного ряда '{time_series}'")
+    settings = Settings(aggregation, strip_query, collapse_ids, max_urls, time_series)
+    errors = ErrorBudget(errors_treshold, errors_min_sample)
+
+    if cache_dir:
+        # Разобранный лог не зависит от настроек агрегации, поэтому их можно
+        # менять, не разбирая лог заново
+        parsed = get_parsed_log(log, cache_dir, workers, use_mmap, errors)
+        n_loglines, n_fails, aggregator = aggregate_parsed(parsed, settings)
+    elif workers > 1 and log.ext != '.gz':
+        # Каждый процесс агрегирует свой диапазон файла, частичные результаты
+        # объединяются в порядке следования диапазонов, поэтому отчет
+        # совпадает с однопроцессной обработкой
+        aggregates = map_chunks(process_chunk, log.path, workers, (settings, use_mmap), errors)
+        n_loglines, n_fails, aggregator = merge_aggregates(aggregates)
+    else:
+        # Контрольные точки сохраняются только при последовательной обработке
+        n_loglines, n_fails, aggregator = process_file(log, settings, checkpoint_path, checkpoint_interval, use_mmap, errors)
+
+    errors_ratio = n_fails / n_loglines
+    if errors_ratio > errors_treshold:
+        raise Exception(f"Доля ошибок {errors_ratio} превышает {errors_treshold}. {errors.format_samples()}")
+
+    return aggregator
+
+def process_log(log: Log, errors_treshold: float, report_size: Optional[int] = None, **kwargs: Any) -> Statistics:
+    """Агрегирует лог (параметры как у aggregate_log) и возвращает статистику по report_size URL"""
+    return get_statistics(aggregate_log(log, errors_treshold, **kwargs), report_size)
 
 def get_report_path(report_dir: pathlib.Path, log: Log) -> pathlib.Path:
     if not report_dir.exists() or not report_dir.is_dir():
@@ -118,22 +1061,32 @@ def get_report_path(report_dir: pathlib.Path, log: Log) -> pathlib.Path:
     report_path = report_dir / report_filename
     return report_path
 
-def get_last_logfile(log_dir: pathlib.Path) -> Optional[Log]:
+def get_logfiles(log_dir: pathlib.Path) -> List[Log]:
+    """Возвращает все логи из log_dir, отсортированные по дате"""
     if not log_dir.exists() or not log_dir.is_dir():
         raise FileNotFoundError("Неверно указан путь к директории с журналами")
     
-    logfile = None
-    pattern = re.compile(r"^nginx-access-ui\.log-(\d{8})(\.gz)?$")
+    logfiles = []
     for path in log_dir.iterdir():
+        match = logfile_pattern.match(path.name)
+        if not match or not path.is_file():
+            continue
+        date, ext = match.groups()
         try:
-            [(date, ext)] = re.findall(pattern, str(path))
             log_date = datetime.datetime.strptime(date, "%Y%m%d").date()
-            if not logfile or logfile.date > log_date:
-                logfile = Log(path, log_date, ext)
         except ValueError:
-            pass
+            continue
+        logfiles.append(Log(path, log_date, ext or ''))
     
-    return logfile
+    return sorted(logfiles, key=lambda log: (log.date, log.ext))
+
+def get_last_logfile(log_dir: pathlib.Path) -> Optional[Log]:
+    """Возвращает самый свежий лог из log_dir (шаблон проверяется только по
+    имени файла, а не по всему пути)"""
+    logfiles = get_logfiles(log_dir)
+    if not logfiles:
+        return None
+    return max(logfiles, key=lambda log: log.date)
 
 def setup_logging(logfile: Optional[str]) -> None:
     logging.basicConfig( # type: ignore
@@ -160,8 +1113,90 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--config",
         dest="config_path",
         help="Путь к конфигурационному файлу")
+    parser.add_argument("--backfill",
+        action="store_true",
+        help="Построить отчеты для всех логов, по которым их еще нет")
     return parser.parse_args()
 
+def build_report(log: Log, report_path: pathlib.Path, config: Config, workers: int,
+                 checkpoint_path: Optional[pathlib.Path] = None) -> None:
+    aggregator = aggregate_log(log,
+        cast(float, config.get("ERRORS_TRESHOLD")),
+        workers,
+        cast(str, config.get("AGGREGATION")),
+        checkpoint_path,
+        cast(int, config.get("CHECKPOINT_INTERVAL")),
+        cast(bool, config.get("STRIP_QUERY")),
+        cast(bool, config.get("COLLAPSE_IDS")),
+        cast(int, config.get("MAX_URLS")),
+        cast(bool, config.get("USE_MMAP")),
+        pathlib.Path(config["CACHE_DIR"]) if config.get("CACHE_DIR") else None,
+        config.get("ERRORS_MIN_SAMPLE"),
+        config.get("TIME_SERIES"))
+    log_statistics = iter_statistics(aggregator, cast(int, config.get("REPORT_SIZE")))
+    series = aggregator.series.to_json() if aggregator.series else None
+    report_template_path = report_path.parent / "report.html"
+    create_report(report_template_path, report_path, log_statistics, series)
+
+def backfill_report(log: Log, report_path: pathlib.Path, config: Config) -> Tuple[Log, float, Optional[str]]:
+    started = time.perf_counter()
+    try:
+        # Файлы уже обрабатываются параллельно, поэтому каждый лог - в одном процессе
+        build_report(log, report_path, config, workers=1)
+    except Exception as e:
+        return log, time.perf_counter() - started, f"{type(e).__name__}: {e}"
+    return log, time.perf_counter() - started, None
+
+def backfill(config: Config) -> None:
+    log_dir = pathlib.Path(cast(str, config.get("LOG_DIR")))
+    report_dir = pathlib.Path(cast(str, config.get("REPORT_DIR")))
+    
+    jobs: Dict[pathlib.Path, Log] = {}
+    for log in get_logfiles(log_dir):
+        report_path = get_report_path(report_dir, log)
+        # Если за один день есть и .gz, и несжатый лог, берется несжатый
+        if not report_path.exists() and report_path not in jobs:
+            jobs[report_path] = log
+    if not jobs:
+        logging.info(f"Нет логов в '{log_dir}' без отчетов")
+        return
+    
+    workers = cast(int, config.get("WORKERS"))
+    if workers <= 1:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(jobs))
+    logging.info(f"Построение {len(jobs)} отчетов в {workers} процессах")
+    
+    started = time.perf_counter()
+    n_built = 0
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.starmap_async(backfill_report,
+            [(log, report_path, config) for report_path, log in jobs.items()], chunksize=1)
+        for log, elapsed, error in results.get():
+            if error:
+                logging.error(f"Не удалось построить отчет для '{log.path}' за {elapsed:.3f} с: {error}")
+            else:
+                n_built += 1
+                logging.info(f"Отчет для '{log.path}' построен за {elapsed:.3f} с")
+    logging.info(f"Построено {n_built} из {len(jobs)} отчетов за {time.perf_counter() - started:.3f} с")
+    
+    if n_built:
+        update_ts(pathlib.Path(cast(str, config.get('TS_FILE'))))
+
+def is_log_appended(log: Log, report_path: pathlib.Path, checkpoint_path: pathlib.Path) -> bool:
+    """Дописан ли несжатый лог после построения отчета при наличии его
+    контрольной точки: тогда отчет обновляется, продолжая с нее"""
+    if log.ext == '.gz' or not checkpoint_path.exists():
+        return False
+    if log.path.stat().st_mtime <= report_path.stat().st_mtime:
+        return False
+    with checkpoint_path.open(mode='rb') as f:
+        try:
+            log_path, _ = pickle.load(f)
+        except Exception:
+            return False
+    return log_path == str(log.path.absolute())
+
 def main(config: Config) -> None:
     log_dir = pathlib.Path(cast(str, config.get("LOG_DIR")))
     last_log = get_last_logfile(log_dir)
@@ -171,17 +1206,18 @@ def main(config: Config) -> None:
 
     report_dir = pathlib.Path(cast(str, config.get("REPORT_DIR")))
     report_path = get_report_path(report_dir, last_log)
-    if report_path.exists():
+    ts_path = pathlib.Path(cast(str, config.get('TS_FILE')))
+    checkpoint_path = get_checkpoint_path(ts_path)
+    if report_path.exists() and not is_log_appended(last_log, report_path, checkpoint_path):
         logging.info(f"Отчет для '{last_log.path}' уже существует")
         return
         
-    log_statistics = process_log(last_log, cast(float, config.get("ERRORS_TRESHOLD")))
-    log_statistics = sorted(log_statistics, key=lambda r: r['time_sum'], reverse=True)
-    log_statistics = log_statistics[:config.get("REPORT_SIZE")]
-    report_template_path = report_dir / "report.html"
-    create_report(report_template_path, report_path, log_statistics)
+    build_report(last_log, report_path, config, cast(int, config.get("WORKERS")), checkpoint_path)
+    # Несжатый лог может еще дописываться, поэтому его контрольная точка
+    # остается для следующего запуска
+    if last_log.ext == '.gz' and checkpoint_path.exists():
+        checkpoint_path.unlink()
     
-    ts_path = pathlib.Path(cast(str, config.get('TS_FILE')))
     update_ts(ts_path)
 
 if __name__ == "__main__":
@@ -190,6 +1226,9 @@ if __name__ == "__main__":
     setup_logging(config.get('LOG_FILE'))
 
     try:
-        main(config)
+        if args.backfill:
+            backfill(config)
+        else:
+            main(config)
     except Exception as e:
         logging.exception(str(e))
\ No newline at end of file
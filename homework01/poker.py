@@ -27,7 +27,45 @@
 # -----------------
 
 import itertools
+import math
+import multiprocessing
+import random
 from collections import Counter
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+RANKS = "23456789TJQKA"
+SUITS = "CSHD"
+# Произведение простых чисел, сопоставленных рангам, однозначно
+# определяет набор рангов "руки" независимо от порядка карт
+RANK_PRIMES = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+CARD_PRIMES = {rank + suit: RANK_PRIMES[i] for i, rank in enumerate(RANKS) for suit in SUITS}
+
+# Таблицы fast_hand_rank (заполняются build_rank_tables при первом вызове):
+# произведение простых -> код "руки" без флеша и с флешем, код -> hand_rank
+# и код -> произведение простых
+RANK_CODES = {}
+FLUSH_CODES = {}
+CODE_RANKS = []
+CODE_PRODUCTS = []
+# Произведение простых 7ми карт -> код лучшей "руки" из 5ти без учета флеша
+# (заполняется build_seven_card_table)
+SEVEN_CARD_CODES = {}
+
+# Номер карты для пакетной оценки: ранг * 4 + масть
+ID_CARDS = [rank + suit for rank in RANKS for suit in SUITS]
+CARD_IDS = {card: card_id for card_id, card in enumerate(ID_CARDS)}
+# Таблицы batch_best_hands (заполняются build_batch_tables): код "руки" без
+# флеша по отсортированным рангам в системе счисления по основанию 13,
+# код флеша по битовой маске рангов, номера карт 21 комбинации из 7ми
+BATCH_TABLES = {}
+# Число "рук", которые batch_best_hands оценивает за раз
+BATCH_CHUNK_SIZE = 1 << 16
 
 
 def hand_rank(hand):
@@ -85,20 +123,370 @@ def two_pair(ranks):
     return (r1, r2) if r1 and (r1 != r2) else None
 
 
+def build_rank_tables():
+    """Заполняет таблицы fast_hand_rank значениями hand_rank для каждого
+    набора рангов из 5ти карт (с флешем и без)"""
+    ranks_by_product = {}
+    flush_ranks_by_product = {}
+    for ranks in itertools.combinations_with_replacement(range(len(RANKS)), 5):
+        if max(Counter(ranks).values()) > len(SUITS):
+            continue
+        product = reduce(lambda a, b: a * b, (RANK_PRIMES[rank] for rank in ranks))
+        # Масти чередуются, чтобы "рука" не оказалась флешем
+        hand = [RANKS[rank] + SUITS[i % len(SUITS)] for i, rank in enumerate(ranks)]
+        ranks_by_product[product] = hand_rank(hand)
+        if len(set(ranks)) == 5:
+            flush_ranks_by_product[product] = hand_rank([RANKS[rank] + SUITS[0] for rank in ranks])
+
+    # Коды упорядочены так же, как значения hand_rank (в них есть списки,
+    # поэтому одинаковые значения ищутся по repr)
+    ranks = {repr(rank): rank for rank in ranks_by_product.values() + flush_ranks_by_product.values()}
+    CODE_RANKS[:] = sorted(ranks.values())
+    codes = {repr(rank): code for code, rank in enumerate(CODE_RANKS)}
+    RANK_CODES.update((p, codes[repr(rank)]) for p, rank in ranks_by_product.iteritems())
+    FLUSH_CODES.update((p, codes[repr(rank)]) for p, rank in flush_ranks_by_product.iteritems())
+    CODE_PRODUCTS[:] = [None] * len(CODE_RANKS)
+    for p, code in itertools.chain(RANK_CODES.iteritems(), FLUSH_CODES.iteritems()):
+        CODE_PRODUCTS[code] = p
+
+
+def build_seven_card_table():
+    """Заполняет SEVEN_CARD_CODES: лучший код набора из 7ми рангов - лучший
+    среди наборов из 6ти (без одного из рангов), а для них - из 5ти"""
+    if not RANK_CODES:
+        build_rank_tables()
+    codes = RANK_CODES
+    for n_cards, table in [(6, {}), (7, SEVEN_CARD_CODES)]:
+        for ranks in itertools.combinations_with_replacement(range(len(RANKS)), n_cards):
+            # Ранги отсортированы, так что 5 одинаковых стоят подряд
+            if any(ranks[i] == ranks[i + len(SUITS)] for i in xrange(n_cards - len(SUITS))):
+                continue
+            product = reduce(lambda a, b: a * b, (RANK_PRIMES[rank] for rank in ranks))
+            table[product] = max(codes[product // RANK_PRIMES[rank]] for rank in set(ranks))
+        codes = table
+
+
+def hand_code(hand):
+    """Номер ранга "руки" из 5ти карт: коды сравниваются так же,
+    как значения hand_rank"""
+    if not RANK_CODES:
+        build_rank_tables()
+    c1, c2, c3, c4, c5 = hand
+    product = CARD_PRIMES[c1] * CARD_PRIMES[c2] * CARD_PRIMES[c3] * CARD_PRIMES[c4] * CARD_PRIMES[c5]
+    if c1[1] == c2[1] == c3[1] == c4[1] == c5[1]:
+        return FLUSH_CODES[product]
+    return RANK_CODES[product]
+
+
+def fast_hand_rank(hand):
+    """hand_rank по таблицам, построенным один раз на процесс.
+    Возвращаемое значение общее для одинаковых "рук", его нельзя менять"""
+    return CODE_RANKS[hand_code(hand)]
+
+
+def seven_card_code(hand):
+    """Код лучшей "руки" из 5ти карт среди 7ми и масть, если это флеш:
+    ранги оцениваются одним поиском в таблице, флеш - только по картам
+    масти, которой в "руке" не меньше 5ти карт"""
+    if not SEVEN_CARD_CODES:
+        build_seven_card_table()
+    c1, c2, c3, c4, c5, c6, c7 = hand
+    code = SEVEN_CARD_CODES[CARD_PRIMES[c1] * CARD_PRIMES[c2] * CARD_PRIMES[c3] * CARD_PRIMES[c4] *
+                            CARD_PRIMES[c5] * CARD_PRIMES[c6] * CARD_PRIMES[c7]]
+    suits = c1[1] + c2[1] + c3[1] + c4[1] + c5[1] + c6[1] + c7[1]
+    for suit in SUITS:
+        if suits.count(suit) >= 5:
+            primes = [CARD_PRIMES[card] for card in hand if card[1] == suit]
+            product = reduce(lambda a, b: a * b, primes)
+            flush_code = max(FLUSH_CODES[product // reduce(lambda a, b: a * b, removed, 1)]
+                             for removed in itertools.combinations(primes, len(primes) - 5))
+            if flush_code > code:
+                return flush_code, suit
+            break
+    return code, None
+
+
 def best_hand(hand):
     """Из "руки" в 7 карт возвращает лучшую "руку" в 5 карт """
-    hands5 = itertools.combinations(hand, 5)
-    return max(hands5, key=hand_rank)
+    if len(hand) != 7:
+        hands5 = itertools.combinations(hand, 5)
+        return max(hands5, key=hand_code)
+
+    # Из карт с нужными рангами (и мастью для флеша) берутся первые, поэтому
+    # результат совпадает с первой лучшей комбинацией itertools.combinations
+    code, flush_suit = seven_card_code(hand)
+    remaining = CODE_PRODUCTS[code]
+    cards = []
+    for card in hand:
+        prime = CARD_PRIMES[card]
+        if not remaining % prime and (flush_suit is None or card[1] == flush_suit):
+            cards.append(card)
+            remaining //= prime
+    return tuple(cards)
+
+
+def encode_hands(hands):
+    """Массив номеров карт (N x число карт) из списка "рук" """
+    if np is None:
+        raise ImportError("Для пакетной оценки нужен numpy")
+    return np.array([[CARD_IDS[card] for card in hand] for hand in hands], dtype=np.uint8)
+
+
+def decode_hands(card_ids, masks=None):
+    """Список "рук" из массива номеров карт; если даны маски (как в
+    batch_best_hands), в "руку" попадают только отмеченные карты"""
+    if masks is None:
+        return [[ID_CARDS[card_id] for card_id in row] for row in card_ids.tolist()]
+    return [tuple(ID_CARDS[card_id] for i, card_id in enumerate(row) if mask >> i & 1)
+            for row, mask in itertools.izip(card_ids.tolist(), masks.tolist())]
+
+
+def build_batch_tables():
+    """Заполняет BATCH_TABLES по таблицам fast_hand_rank"""
+    if not RANK_CODES:
+        build_rank_tables()
+    n_ranks = len(RANKS)
+    rank_table = np.zeros(n_ranks ** 5, dtype=np.int16)
+    for ranks in itertools.combinations_with_replacement(range(n_ranks), 5):
+        if max(Counter(ranks).values()) > len(SUITS):
+            continue
+        index = reduce(lambda a, b: a * n_ranks + b, ranks)
+        rank_table[index] = RANK_CODES[reduce(lambda a, b: a * b, (RANK_PRIMES[rank] for rank in ranks))]
+    flush_table = np.zeros(1 << n_ranks, dtype=np.int16)
+    for ranks in itertools.combinations(range(n_ranks), 5):
+        mask = sum(1 << rank for rank in ranks)
+        flush_table[mask] = FLUSH_CODES[reduce(lambda a, b: a * b, (RANK_PRIMES[rank] for rank in ranks))]
+    combinations = np.array(list(itertools.combinations(range(7), 5)))
+    # Маска выбранных позиций -> номер комбинации в порядке itertools.combinations
+    combination_index = np.zeros(1 << 7, dtype=np.int32)
+    combination_index[(1 << combinations).sum(axis=1)] = np.arange(len(combinations))
+    BATCH_TABLES.update(
+        rank_table=rank_table,
+        flush_table=flush_table,
+        combinations=combinations,
+        combination_index=combination_index,
+    )
+
+
+def batch_best_hands(card_ids):
+    """best_hand для массива "рук" из 7ми карт (N x 7 номеров карт).
+
+    Возвращает коды лучших "рук" (как hand_code) и маски выбранных карт:
+    бит i установлен, если в лучшую "руку" входит i-я карта строки.
+    Из равных по рангу комбинаций выбирается первая, как в best_hand.
+    """
+    if np is None:
+        raise ImportError("Для пакетной оценки нужен numpy")
+    if not BATCH_TABLES:
+        build_batch_tables()
+    card_ids = np.asarray(card_ids)
+    # Промежуточные массивы (N x 21 x 5) занимают около 1.6 КБ на "руку",
+    # поэтому строки оцениваются кусками по BATCH_CHUNK_SIZE
+    chunks = [card_ids[start:start + BATCH_CHUNK_SIZE] for start in xrange(0, len(card_ids), BATCH_CHUNK_SIZE)]
+    codes, masks = zip(*[chunk_best_hands(chunk) for chunk in chunks or [card_ids]])
+    return np.concatenate(codes), np.concatenate(masks)
+
+
+def chunk_best_hands(card_ids):
+    """batch_best_hands для одного куска строк"""
+    combinations = BATCH_TABLES["combinations"]
+    rows = np.arange(len(card_ids))[:, None]
+
+    # Карты сортируются один раз, тогда ранги каждой комбинации (N x 21 x 5)
+    # уже идут по возрастанию
+    order = np.argsort(card_ids, axis=1)
+    hands = card_ids[rows, order][:, combinations].astype(np.int32)
+    ranks = hands // len(SUITS)
+    suits = hands % len(SUITS)
+    index = ranks[:, :, 0]
+    for i in xrange(1, 5):
+        index = index * len(RANKS) + ranks[:, :, i]
+    codes = BATCH_TABLES["rank_table"][index]
+    is_flush = (suits == suits[:, :, :1]).all(axis=2)
+    if is_flush.any():
+        rank_masks = np.bitwise_or.reduce(1 << ranks[is_flush], axis=1)
+        codes[is_flush] = BATCH_TABLES["flush_table"][rank_masks]
+
+    # Из равных кодов выбирается комбинация, первая по исходным позициям карт
+    masks = (1 << order[:, combinations]).sum(axis=2)
+    first = len(combinations) - 1 - BATCH_TABLES["combination_index"][masks]
+    best = (codes.astype(np.int32) * 32 + first).argmax(axis=1)
+    rows = rows[:, 0]
+    return codes[rows, best], masks[rows, best].astype(np.uint8)
+
+
+# Результат equity: вероятности выигрыша, ничьей и доля банка каждого
+# игрока, число оцененных раскладов и был ли перебор полным
+Equity = namedtuple("Equity", "win tie equity n_boards exhaustive")
+# Квантиль нормального распределения для оценки точности equity (95%)
+EQUITY_Z = 1.96
+EQUITY_BATCH_SIZE = 2000
+
+
+def board_results(hole_cards, board, boards):
+    """Число выигрышей, ничьих, сумма долей банка и их квадратов для
+    каждого игрока по раскладам boards (карты, которых не хватает на столе)"""
+    n_players = len(hole_cards)
+    wins = [0] * n_players
+    ties = [0] * n_players
+    shares = [0.] * n_players
+    squares = [0.] * n_players
+    n_boards = 0
+    for cards in boards:
+        n_boards += 1
+        full_board = board + list(cards)
+        codes = [seven_card_code(hole + full_board)[0] for hole in hole_cards]
+        best = max(codes)
+        winners = [i for i, code in enumerate(codes) if code == best]
+        share = 1. / len(winners)
+        for i in winners:
+            if len(winners) == 1:
+                wins[i] += 1
+            else:
+                ties[i] += 1
+            shares[i] += share
+            squares[i] += share * share
+    return n_boards, wins, ties, shares, squares
+
+
+def sample_batch(args):
+    """Случайные расклады пакета: генератор зависит только от seed
+    и номера пакета, а не от процесса, в котором пакет считается"""
+    hole_cards, board, deck, seed, batch, size = args
+    rnd = random.Random(seed * 2 ** 32 + batch)
+    n_missing = 5 - len(board)
+    return board_results(hole_cards, board, (rnd.sample(deck, n_missing) for _ in xrange(size)))
+
+
+def enumerate_batch(args):
+    """Расклады с start по stop из перебора всех сочетаний карт колоды"""
+    hole_cards, board, deck, start, stop = args
+    boards = itertools.islice(itertools.combinations(deck, 5 - len(board)), start, stop)
+    return board_results(hole_cards, board, boards)
+
+
+def n_combinations(n, k):
+    return reduce(lambda a, i: a * (n - i) // (i + 1), xrange(k), 1)
+
+
+def equity(hole_cards, board=(), n_samples=100000, precision=None, workers=1, seed=0,
+           batch_size=EQUITY_BATCH_SIZE):
+    """Вероятности выигрыша и ничьей игроков с карманными картами hole_cards
+    при открытых картах стола board (от 0 до 5).
+
+    Если различных раскладов оставшихся карт не больше n_samples, они
+    перебираются все, иначе оцениваются до n_samples случайных раскладов
+    пакетами по batch_size. С precision оценка останавливается, как только
+    полуширина доверительного интервала equity каждого игрока не больше
+    precision. Пакеты считаются в workers процессах, но учитываются по
+    порядку, поэтому результат зависит только от seed.
+    """
+    hole_cards = [list(hole) for hole in hole_cards]
+    board = list(board)
+    used = [card for hole in hole_cards for card in hole] + board
+    if len(set(used)) != len(used) or any(card not in CARD_PRIMES for card in used):
+        raise ValueError("Карты повторяются или не существуют: %s" % " ".join(used))
+    if len(board) > 5 or any(len(hole) != 2 for hole in hole_cards):
+        raise ValueError("У каждого игрока должно быть 2 карты, на столе - не больше 5ти")
+    if n_samples < 1 or batch_size < 1:
+        raise ValueError("n_samples и batch_size должны быть положительными")
+    deck = [card for card in ID_CARDS if card not in used]
+    if len(deck) < 5 - len(board):
+        raise ValueError("Не хватает карт, чтобы заполнить стол")
+
+    n_boards = n_combinations(len(deck), 5 - len(board))
+    exhaustive = n_boards <= n_samples
+    if exhaustive:
+        tasks = [(hole_cards, board, deck, start, min(start + batch_size, n_boards))
+                 for start in xrange(0, n_boards, batch_size)]
+        func = enumerate_batch
+    else:
+        tasks = [(hole_cards, board, deck, seed, batch, min(batch_size, n_samples - batch * batch_size))
+                 for batch in xrange((n_samples + batch_size - 1) // batch_size)]
+        func = sample_batch
+
+    # Таблицы строятся до запуска процессов, чтобы те получили их готовыми
+    if not SEVEN_CARD_CODES:
+        build_seven_card_table()
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        results = pool.imap(func, tasks) if pool else itertools.imap(func, tasks)
+        n_players = len(hole_cards)
+        n = 0
+        wins, ties, shares, squares = [0] * n_players, [0] * n_players, [0.] * n_players, [0.] * n_players
+        for result in results:
+            n += result[0]
+            for counts, batch_counts in zip([wins, ties, shares, squares], result[1:]):
+                for i, count in enumerate(batch_counts):
+                    counts[i] += count
+            if precision and not exhaustive and equity_error(n, shares, squares) <= precision:
+                break
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+    return Equity([float(w) / n for w in wins], [float(t) / n for t in ties],
+                  [share / n for share in shares], n, exhaustive)
+
+
+def equity_error(n, shares, squares):
+    """Наибольшая среди игроков полуширина доверительного интервала equity"""
+    if n < 2:
+        return float("inf")
+    return max(EQUITY_Z * math.sqrt(max(square / n - (share / n) ** 2, 0.) / (n - 1))
+               for share, square in zip(shares, squares))
+
+
+JOKERS = {"?B": "CS", "?R": "HD"}
+
+
+def wild_candidates(clear_hand, joker_suits):
+    """Для каждого джокера карты, замена на которые может дать лучшую
+    "руку": карты мастей, в которых возможен флеш, и по одной карте
+    (первой свободной масти) рангов, которые дают пару и больше,
+    дополняют стрит или являются старшими из отсутствующих в "руке"
+    """
+    clear_ranks = set(rank for rank, suit in clear_hand)
+    n_jokers = len(joker_suits)
+    absent_ranks = [rank for rank in RANKS if rank not in clear_ranks]
+    useful_ranks = clear_ranks | set(absent_ranks[len(absent_ranks) - n_jokers:])
+    for start in xrange(len(RANKS) - 4):
+        missing = [rank for rank in RANKS[start:start + 5] if rank not in clear_ranks]
+        if len(missing) <= n_jokers:
+            useful_ranks.update(missing)
+
+    suit_counts = Counter(suit for rank, suit in clear_hand)
+    flush_suits = set(suit for suit in SUITS
+                      if suit_counts[suit] + sum(suit in suits for suits in joker_suits) >= 5)
+    candidates = []
+    for suits in joker_suits:
+        cards = []
+        for rank in RANKS:
+            free = [rank + suit for suit in suits if rank + suit not in clear_hand]
+            cards.extend(card for i, card in enumerate(free)
+                         if card[1] in flush_suits or (i == 0 and rank in useful_ranks))
+        candidates.append(cards)
+    return candidates
 
 
 def best_wild_hand(hand):
     """best_hand но с джокерами"""
-    jokers = {"?B": "CS", "?R": "HD"}
-    clear_hand = [card for card in hand if card not in jokers]
-    joker_suits = [jokers[card] for card in hand if card in jokers]
+    clear_hand = [card for card in hand if card not in JOKERS]
+    joker_suits = [JOKERS[card] for card in hand if card in JOKERS]
+    # Замены перебираются в том же порядке, что и в brute_force_wild_hand,
+    # из равных по рангу "рук" выбирается первая
+    substitutions = itertools.product(*wild_candidates(clear_hand, joker_suits))
+    return max((best_hand(clear_hand + list(cards)) for cards in substitutions), key=hand_code)
+
+
+def brute_force_wild_hand(hand):
+    """best_wild_hand перебором всех замен джокеров"""
+    clear_hand = [card for card in hand if card not in JOKERS]
+    joker_suits = [JOKERS[card] for card in hand if card in JOKERS]
     hands = [clear_hand]
     for joker_suit in joker_suits:
-        cards = ["%s%s"%(r,s) for r,s in itertools.product("23456789TJQKA", joker_suit)]
+        cards = ["%s%s"%(r,s) for r,s in itertools.product(RANKS, joker_suit)]
         cards = [card for card in cards if card not in clear_hand]
         hands = [h + [card] for h in hands for card in cards]
     return max(set([best_hand(h) for h in hands]), key=hand_rank)
@@ -0,0 +1,253 @@
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+if sys.version_info[0] > 2:
+    raise unittest.SkipTest("deco.py is written for Python 2")
+
+import deco
+
+
+def square_pid(x):
+    return x * x, os.getpid()
+
+
+def shared_square(args):
+    directory, x = args
+    return deco.memo(storage=deco.FileStorage(directory))(square_pid)(x)
+
+
+class FakeTimer(object):
+
+    def __init__(self):
+        self.now = 0.
+
+    def __call__(self):
+        return self.now
+
+
+class TestMemo(unittest.TestCase):
+
+    def test_counters(self):
+        @deco.memo
+        @deco.countcalls
+        def square(x):
+            return x * x
+
+        self.assertEqual([4, 9, 4], [square(2), square(3), square(2)])
+        self.assertEqual((1, 2, 0), (square.hits, square.misses, square.evictions))
+        self.assertEqual(2, square.calls)
+
+    def test_unhashable_args(self):
+        add = deco.memo(deco.n_ary(lambda a, b: a + b))
+        self.assertEqual([1, 2, 3], add([1], [2], [3]))
+        self.assertEqual([1, 2, 3], add([1], [2], [3]))
+        self.assertEqual({"a": [1]}, deco.memo(lambda d: d)({"a": [1]}))
+        self.assertEqual(1, add.hits)
+        self.assertNotEqual(deco.freeze([1, 2]), deco.freeze((1, 2)))
+
+    def test_key_function(self):
+        length = deco.memo(lambda seq: len(seq), key=len)
+        self.assertEqual(3, length("abc"))
+        self.assertEqual(3, length("xyz"))
+        self.assertEqual(1, length.hits)
+
+    def test_lru_eviction(self):
+        calls = []
+        cube = deco.memo(maxsize=2)(lambda x: calls.append(x) or x ** 3)
+        for x in [1, 2, 1, 3, 1, 2]:
+            cube(x)
+        self.assertEqual([1, 2, 3, 2], calls)
+        self.assertEqual((2, 4, 2), (cube.hits, cube.misses, cube.evictions))
+
+    def test_ttl(self):
+        timer = FakeTimer()
+        calls = []
+        double = deco.memo(ttl=10, timer=timer)(lambda x: calls.append(x) or 2 * x)
+        double(1)
+        timer.now = 9
+        double(1)
+        timer.now = 10
+        double(1)
+        self.assertEqual([1, 1], calls)
+        self.assertEqual((1, 2, 1), (double.hits, double.misses, double.evictions))
+
+    def test_recursion(self):
+        @deco.memo(maxsize=3)
+        def fib(n):
+            return 1 if n <= 1 else fib(n - 1) + fib(n - 2)
+
+        self.assertEqual(10946, fib(20))
+        self.assertEqual(21, fib.misses)
+
+    def test_disable(self):
+        f = lambda x: x
+        self.assertIs(f, deco.disable(f))
+        self.assertIs(f, deco.disable(maxsize=10)(f))
+
+
+class TestNAry(unittest.TestCase):
+
+    def test_right_fold(self):
+        pair = deco.n_ary(lambda a, b: (a, b))
+        self.assertEqual(1, pair(1))
+        self.assertEqual((1, (2, (3, 4))), pair(1, 2, 3, 4))
+
+    def test_many_arguments(self):
+        add = deco.n_ary(lambda a, b: a + b)
+        self.assertEqual(sum(xrange(10000)), add(*xrange(10000)))
+
+    def test_tree_keeps_order(self):
+        concat = deco.n_ary(tree=True)(lambda a, b: a + b)
+        words = [str(i) for i in xrange(1001)]
+        self.assertEqual("".join(words), concat(*words))
+        self.assertEqual("a", concat("a"))
+        self.assertEqual(deco.n_ary(lambda a, b: a + b)(*words), concat(*words))
+
+
+class TestProfiled(unittest.TestCase):
+
+    def setUp(self):
+        deco.reset_stats()
+
+    def test_call_stats(self):
+        @deco.profiled
+        def fib(n):
+            return 1 if n <= 1 else fib(n - 1) + fib(n - 2)
+
+        @deco.profiled
+        def outer():
+            return fib(10)
+
+        outer()
+        fib_stats = deco.PROFILE_STATS[__name__ + ".fib"]
+        outer_stats = deco.PROFILE_STATS[__name__ + ".outer"]
+        self.assertEqual(177, fib_stats.calls)
+        self.assertEqual(177, sum(fib_stats.histogram.values()))
+        self.assertEqual(1, outer_stats.calls)
+        self.assertLessEqual(fib_stats.total_time, outer_stats.total_time)
+        self.assertAlmostEqual(outer_stats.total_time, outer_stats.self_time + fib_stats.total_time, places=3)
+
+        deco.reset_stats()
+        self.assertEqual(0, fib_stats.calls)
+        fib(1)
+        self.assertEqual(1, fib_stats.calls)
+
+    def test_fast_calls_histogram(self):
+        noop = deco.profiled(lambda: None)
+        for _ in xrange(100000):
+            noop()
+        histogram = deco.PROFILE_STATS[__name__ + ".<lambda>"].histogram
+        self.assertEqual(100000, sum(histogram.values()))
+        self.assertNotIn(0, histogram)
+        self.assertTrue(all(exponent is deco.ZERO_TIME or exponent < -5 for exponent in histogram))
+
+    def test_threads(self):
+        noop = deco.profiled(lambda: None)
+
+        def work():
+            for _ in xrange(20000):
+                noop()
+
+        threads = [threading.Thread(target=work) for _ in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = deco.PROFILE_STATS[__name__ + ".<lambda>"]
+        self.assertEqual(8 * 20000, stats.calls)
+        self.assertEqual(8 * 20000, sum(stats.histogram.values()))
+
+    def test_exception(self):
+        @deco.profiled
+        def fail():
+            raise RuntimeError
+
+        with self.assertRaises(RuntimeError):
+            fail()
+        self.assertEqual(1, deco.PROFILE_STATS[__name__ + ".fail"].calls)
+
+    def test_dump_stats(self):
+        lines = []
+
+        class Stream(object):
+            write = lines.append
+
+        deco.profiled(lambda: None)()
+        deco.dump_stats(Stream())
+        self.assertIn("<lambda>", "".join(lines))
+
+
+class TestMemoStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_striped_dict_threads(self):
+        storage = deco.StripedDict(stripes=4)
+        square = deco.memo(storage=storage)(lambda x: x * x)
+
+        def work():
+            for x in xrange(200):
+                assert square(x) == x * x
+
+        threads = [threading.Thread(target=work) for _ in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(200, len(storage))
+        self.assertEqual(1, storage[(3,)] / 9)
+        self.assertEqual(8 * 200, square.hits + square.misses)
+
+    def test_lru_threads(self):
+        square = deco.memo(maxsize=50)(lambda x: x * x)
+
+        def work():
+            for x in xrange(500):
+                assert square(x % 70) == (x % 70) ** 2
+
+        threads = [threading.Thread(target=work) for _ in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(8 * 500, square.hits + square.misses)
+
+    def test_file_storage_is_shared_between_processes(self):
+        pool = multiprocessing.Pool(2)
+        try:
+            results = pool.map(shared_square, [(self.tmp_dir, x) for x in [2, 3, 2, 3]])
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual([4, 9, 4, 9], [square for square, _ in results])
+        self.assertEqual(2, len(deco.FileStorage(self.tmp_dir)))
+
+        cached = deco.memo(storage=deco.FileStorage(self.tmp_dir))(square_pid)
+        self.assertEqual(results[0], cached(2))
+        self.assertEqual(1, cached.hits)
+
+    def test_file_storage_clear(self):
+        storage = deco.FileStorage(self.tmp_dir)
+        storage[("a", [1])] = [1, 2]
+        self.assertEqual([1, 2], storage[("a", [1])])
+        storage.clear()
+        self.assertEqual(0, len(storage))
+        with self.assertRaises(KeyError):
+            storage[("a", [1])]
+
+    def test_storage_with_maxsize(self):
+        with self.assertRaises(ValueError):
+            deco.memo(maxsize=10, storage={})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,475 @@
+import collections
+import datetime
+import gzip
+import pathlib
+import json
+import os
+import random
+import statistics
+import string
+import tempfile
+import unittest
+from unittest import mock
+
+import log_analyzer
+
+
+LINE_TEMPLATE = (
+    '1.196.116.32 -  - [29/Jun/2017:03:50:22 +0300] "GET {url} HTTP/1.1" 200 927 "-" '
+    '"Lynx/2.8.8dev.9 libwww-FM/2.14 SSL-MM/1.4.1 GNUTLS/2.10.5" "-" '
+    '"1498697422-2190034393-4708-9752759" "dc7161be3" {request_time}\n'
+)
+
+
+def make_lines(n_lines, n_urls=50, seed=0):
+    rnd = random.Random(seed)
+    lines = []
+    for _ in range(n_lines):
+        url = f"/api/v2/banner/{rnd.randrange(n_urls)}"
+        lines.append(LINE_TEMPLATE.format(url=url, request_time=f"{rnd.expovariate(5):.3f}"))
+    return lines
+
+
+class TestFastProcessLine(unittest.TestCase):
+
+    def test_same_as_process_line(self):
+        lines = make_lines(100) + [
+            LINE_TEMPLATE.format(url="/api/1", request_time="1.5").rstrip(),
+            LINE_TEMPLATE.format(url="/api/1", request_time="1"),
+            LINE_TEMPLATE.format(url="/api/1", request_time="nan"),
+            LINE_TEMPLATE.format(url="/api/1", request_time="1e3"),
+            LINE_TEMPLATE.format(url="/api/1\" x", request_time="0.1"),
+            LINE_TEMPLATE.replace("GET {url} HTTP/1.1", "0").format(request_time="0.1"),
+            LINE_TEMPLATE.replace("[29/Jun/2017:03:50:22 +0300]", "-").format(url="/api/1", request_time="0.1"),
+            LINE_TEMPLATE.replace(" 200 ", " abc ").format(url="/api/1", request_time="0.1"),
+            LINE_TEMPLATE.replace(" 927 ", "  ").format(url="/api/1", request_time="0.1"),
+            LINE_TEMPLATE.replace("1.196.116.32 -  -", "1.196.116.32 -").format(url="/api/1", request_time="0.1"),
+            LINE_TEMPLATE.replace("1.196.116.32", "host").format(url="/api/1", request_time="0.1"),
+            LINE_TEMPLATE.replace('" "-" ', '" ').format(url="/api/1", request_time="0.1"),
+            LINE_TEMPLATE.format(url="/api/1", request_time="0.1 x"),
+            LINE_TEMPLATE.format(url="/api/1", request_time="0.1x"),
+            '1.2.3.4 - [x] "GET /api/1 HTTP/1.1" 1.5\n',
+            "",
+            "garbage\n",
+        ]
+        for line in lines:
+            self.assertEqual(log_analyzer.process_line(line), log_analyzer.fast_process_line(line.encode()))
+
+    def test_malformed_lines_same_as_process_line(self):
+        rnd = random.Random(0)
+        line = LINE_TEMPLATE.format(url="/api/1", request_time="0.390")
+        for _ in range(20000):
+            chars = list(line)
+            for _ in range(rnd.randint(1, 3)):
+                position = rnd.randrange(len(chars))
+                chars[position:position + rnd.randint(0, 1)] = rnd.choice([' ', '"', '[', ']', '\t', '\n', '0', 'a', '.', '-', ''])
+            mutated = "".join(chars)
+            self.assertEqual(log_analyzer.process_line(mutated), log_analyzer.fast_process_line(mutated.encode()), mutated)
+
+    def test_process_line_bytes(self):
+        for line in make_lines(20) + ["garbage\n"]:
+            self.assertEqual(log_analyzer.process_line(line), log_analyzer.process_line_bytes(line.encode()))
+
+
+class TestNormalizeUrl(unittest.TestCase):
+
+    def test_normalize_url(self):
+        cases = [
+            ("/api/v2/banner/25019354", True, True, "/api/v2/banner/{id}"),
+            ("/api/v2/banner/25019354/?a=1&b=/2", True, True, "/api/v2/banner/{id}/"),
+            ("/api/v2/banner/25019354/?a=1&b=/2", False, True, "/api/v2/banner/{id}/?a=1&b=/2"),
+            ("/api/v2/banner/25019354?a=1", True, False, "/api/v2/banner/25019354"),
+            ("/api/1v2/12/34", True, True, "/api/1v2/{id}/{id}"),
+        ]
+        for url, strip_query, collapse_ids, expected in cases:
+            self.assertEqual(expected, log_analyzer.normalize_url(url, strip_query, collapse_ids))
+
+
+class TestQuantileSketch(unittest.TestCase):
+
+    def test_relative_error_is_bounded(self):
+        rnd = random.Random(1)
+        values = sorted(rnd.lognormvariate(-1, 1.5) for _ in range(10001))
+        sketch = log_analyzer.QuantileSketch()
+        for value in values:
+            sketch.add(value)
+        for q in (0.1, 0.5, 0.9, 0.99):
+            exact = values[int(q * (len(values) - 1))]
+            self.assertLessEqual(abs(sketch.quantile(q) - exact),
+                                 log_analyzer.SKETCH_RELATIVE_ACCURACY * exact)
+
+    def test_merge_equals_single_sketch(self):
+        rnd = random.Random(2)
+        values = [rnd.expovariate(5) for _ in range(1000)] + [0.] * 10
+        single = log_analyzer.QuantileSketch()
+        parts = [log_analyzer.QuantileSketch() for _ in range(3)]
+        for i, value in enumerate(values):
+            single.add(value)
+            parts[i % 3].add(value)
+        merged = parts[0]
+        merged.merge(parts[1])
+        merged.merge(parts[2])
+        self.assertEqual(single.count, merged.count)
+        self.assertEqual(single.max, merged.max)
+        for q in (0., 0.5, 0.95, 1.):
+            self.assertEqual(single.quantile(q), merged.quantile(q))
+
+
+class TestProcessLog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_path = pathlib.Path(self.tmp_dir.name) / "nginx-access-ui.log-20170630"
+        self.log_path.write_text("".join(make_lines(5000)))
+        self.log = log_analyzer.Log(self.log_path, datetime.date(2017, 6, 30), "")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_chunks_are_aligned_on_lines(self):
+        data = self.log_path.read_bytes()
+        chunks = log_analyzer.get_chunks(self.log_path, 7)
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], len(data))
+        for (_, end), (start, _) in zip(chunks, chunks[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual(data[start - 1:start], b"\n")
+
+    def test_percentiles(self):
+        times = collections.defaultdict(list)
+        for line in self.log_path.read_text().splitlines():
+            request = log_analyzer.process_line(line)
+            times[request.url].append(request.request_time)
+        for row in log_analyzer.process_log(self.log, 0.01):
+            request_times = times[row['url']]
+            self.assertEqual(round(statistics.median(request_times), 3), row['time_med'])
+            for key, n in (('time_p90', 9), ('time_p95', 19), ('time_p99', 99)):
+                quantiles = statistics.quantiles(request_times, n=n + 1, method='inclusive')
+                self.assertAlmostEqual(quantiles[n - 1], row[key], delta=0.0006)
+            self.assertLessEqual(row['time_med'], row['time_p90'])
+            self.assertLessEqual(row['time_p99'], row['time_max'])
+
+    def test_report_size_selects_top_urls(self):
+        full = log_analyzer.process_log(self.log, 0.01)
+        self.assertEqual(sorted(full, key=lambda r: r['time_sum'], reverse=True), full)
+        self.assertEqual(full[:7], log_analyzer.process_log(self.log, 0.01, report_size=7))
+
+    def test_mmap_reader(self):
+        self.assertEqual(list(log_analyzer.read_lines(self.log)), list(log_analyzer.read_lines(self.log, use_mmap=True)))
+        for start, end in log_analyzer.get_chunks(self.log_path, 3):
+            self.assertEqual(list(log_analyzer.read_chunk(self.log_path, start, end)),
+                             list(log_analyzer.read_chunk(self.log_path, start, end, use_mmap=True)))
+        with self.log_path.open(mode="a") as f:
+            f.write("no newline at the end")
+        self.assertEqual(list(log_analyzer.read_lines(self.log, 1000)), list(log_analyzer.read_lines(self.log, 1000, use_mmap=True)))
+        self.assertEqual(log_analyzer.process_log(self.log, 0.01), log_analyzer.process_log(self.log, 0.01, workers=2, use_mmap=True))
+
+    def test_workers_produce_same_statistics(self):
+        expected = log_analyzer.process_log(self.log, 0.01)
+        self.assertEqual(expected, log_analyzer.process_log(self.log, 0.01, workers=4))
+
+    def test_approximate_median_error_is_bounded(self):
+        exact = {row['url']: row for row in log_analyzer.process_log(self.log, 0.01)}
+        approx = log_analyzer.process_log(self.log, 0.01, aggregation="approx")
+        self.assertEqual(len(exact), len(approx))
+        for row in approx:
+            expected = exact[row['url']]
+            for key in ('count', 'count_perc', 'time_sum', 'time_perc', 'time_max'):
+                self.assertEqual(expected[key], row[key])
+            self.assertAlmostEqual(expected['time_avg'], row['time_avg'], places=3)
+            for key in ('time_med', 'time_p90', 'time_p95', 'time_p99'):
+                # Плюс ошибка округления до 3-х знаков
+                tolerance = log_analyzer.SKETCH_RELATIVE_ACCURACY * expected[key] + 0.001
+                self.assertLessEqual(abs(expected[key] - row[key]), tolerance)
+
+    def test_approximate_workers_produce_same_statistics(self):
+        expected = log_analyzer.process_log(self.log, 0.01, aggregation="approx")
+        self.assertEqual(expected, log_analyzer.process_log(self.log, 0.01, workers=3, aggregation="approx"))
+
+    def test_max_urls_spills_rare_urls(self):
+        full = log_analyzer.process_log(self.log, 0.01, aggregation="approx")
+        for aggregation in log_analyzer.AGGREGATORS:
+            capped = log_analyzer.process_log(self.log, 0.01, aggregation=aggregation, max_urls=10)
+            self.assertLessEqual(len(capped), 10)
+            self.assertIn(log_analyzer.OTHER_URL, [row['url'] for row in capped])
+            self.assertEqual(sum(row['count'] for row in full), sum(row['count'] for row in capped))
+            self.assertAlmostEqual(sum(row['time_sum'] for row in full), sum(row['time_sum'] for row in capped), places=2)
+
+    def test_aggregator_must_implement_all_methods(self):
+        class PartialAggregator(log_analyzer.Aggregator):
+            def add(self, url, request_time):
+                pass
+
+        with self.assertRaises(TypeError):
+            PartialAggregator()
+
+    def test_collapse_ids(self):
+        stat = log_analyzer.process_log(self.log, 0.01, collapse_ids=True)
+        self.assertEqual(["/api/v2/banner/{id}"], [row['url'] for row in stat])
+        self.assertEqual(5000, stat[0]['count'])
+
+    def test_parsed_log_cache(self):
+        cache_dir = pathlib.Path(self.tmp_dir.name)
+        parsed_path = log_analyzer.get_parsed_path(cache_dir, self.log)
+        for kwargs in [{}, {"workers": 3}, {"collapse_ids": True, "aggregation": "approx"}]:
+            expected = log_analyzer.process_log(self.log, 0.01, **kwargs)
+            self.assertEqual(expected, log_analyzer.process_log(self.log, 0.01, cache_dir=cache_dir, **kwargs))
+            self.assertTrue(parsed_path.exists())
+            self.assertEqual(expected, log_analyzer.process_log(self.log, 0.01, cache_dir=cache_dir, **kwargs))
+
+        with self.log_path.open(mode="a") as f:
+            f.write("".join(make_lines(10, seed=1)))
+        self.assertIsNone(log_analyzer.load_parsed(parsed_path, self.log))
+        self.assertEqual(log_analyzer.process_log(self.log, 0.01),
+                         log_analyzer.process_log(self.log, 0.01, cache_dir=cache_dir))
+        self.assertEqual(5010, log_analyzer.load_parsed(parsed_path, self.log).n_loglines)
+
+    def test_time_series(self):
+        lines = make_lines(3000)
+        for i, line in enumerate(lines):
+            lines[i] = line.replace("03:50:22", f"{i // 1000:02}:{i % 60:02}:00")
+        self.log_path.write_text("".join(lines))
+        cache_dir = pathlib.Path(self.tmp_dir.name)
+
+        aggregator = log_analyzer.aggregate_log(self.log, 0.01, time_series="hour")
+        expected = aggregator.series.to_json()
+        rows = expected["total"]
+        self.assertEqual(["2017-06-29T00:00", "2017-06-29T01:00", "2017-06-29T02:00"], [row["time"] for row in rows])
+        self.assertEqual([1000] * 3, [row["count"] for row in rows])
+        for kwargs in [{"workers": 3}, {"cache_dir": cache_dir}, {"cache_dir": cache_dir}]:
+            aggregator = log_analyzer.aggregate_log(self.log, 0.01, time_series="hour", **kwargs)
+            self.assertEqual(expected, aggregator.series.to_json())
+
+        minutes = log_analyzer.aggregate_log(self.log, 0.01, time_series="minute", cache_dir=cache_dir)
+        self.assertEqual(180, len(minutes.series.to_json()["total"]))
+        with self.assertRaises(ValueError):
+            log_analyzer.aggregate_log(self.log, 0.01, time_series="day")
+
+    def test_errors_early_abort(self):
+        lines = make_lines(5000)
+        lines[::10] = ["broken line\n"] * len(lines[::10])
+        self.log_path.write_text("".join(lines))
+        for workers in (1, 2):
+            with self.assertRaisesRegex(Exception, "прервана после 10\\d\\d строк.*'broken line'"):
+                log_analyzer.process_log(self.log, 0.01, workers=workers, errors_min_sample=1000)
+            with self.assertRaisesRegex(Exception, "^Доля ошибок 0.1 .*'broken line'"):
+                log_analyzer.process_log(self.log, 0.01, workers=workers)
+        # Доля ошибок ниже порога: обработка не прерывается
+        log_analyzer.process_log(self.log, 0.2, errors_min_sample=100)
+
+    def test_resume_from_checkpoint(self):
+        checkpoint_path = pathlib.Path(self.tmp_dir.name) / "log_analyzer.ts.checkpoint"
+        log_analyzer.process_log(self.log, 0.01, checkpoint_path=checkpoint_path, checkpoint_interval=1000)
+        checkpoint = log_analyzer.load_checkpoint(checkpoint_path, self.log, log_analyzer.default_settings)
+        self.assertEqual(checkpoint.offset, self.log_path.stat().st_size)
+
+        with self.log_path.open(mode="a") as f:
+            f.write("".join(make_lines(1000, seed=1)))
+        resumed = log_analyzer.process_log(self.log, 0.01, checkpoint_path=checkpoint_path, checkpoint_interval=1000)
+        self.assertEqual(log_analyzer.process_log(self.log, 0.01), resumed)
+        approx_settings = log_analyzer.default_settings._replace(aggregation="approx")
+        self.assertIsNone(log_analyzer.load_checkpoint(checkpoint_path, self.log, approx_settings))
+
+    def test_partial_line_is_not_checkpointed(self):
+        checkpoint_path = pathlib.Path(self.tmp_dir.name) / "log_analyzer.ts.checkpoint"
+        line = LINE_TEMPLATE.format(url="/api/partial", request_time="0.390")
+        with self.log_path.open(mode="a") as f:
+            f.write(line[:-3])
+        statistics = log_analyzer.process_log(self.log, 0.01, checkpoint_path=checkpoint_path, checkpoint_interval=1000)
+        self.assertEqual(log_analyzer.process_log(self.log, 0.01), statistics)
+        self.assertIn("/api/partial", [stat["url"] for stat in statistics])
+        checkpoint = log_analyzer.load_checkpoint(checkpoint_path, self.log, log_analyzer.default_settings)
+        self.assertEqual(self.log_path.stat().st_size - len(line) + 3, checkpoint.offset)
+
+        with self.log_path.open(mode="a") as f:
+            f.write(line[-3:])
+        resumed = log_analyzer.process_log(self.log, 0.01, checkpoint_path=checkpoint_path, checkpoint_interval=1000)
+        self.assertEqual(log_analyzer.process_log(self.log, 0.01), resumed)
+        self.assertEqual(0.39, [stat for stat in resumed if stat["url"] == "/api/partial"][0]["time_sum"])
+
+    def test_torn_checkpoint_record_is_ignored(self):
+        checkpoint_path = pathlib.Path(self.tmp_dir.name) / "log_analyzer.ts.checkpoint"
+        log_analyzer.process_log(self.log, 0.01, checkpoint_path=checkpoint_path, checkpoint_interval=1000)
+        data = checkpoint_path.read_bytes()
+        checkpoint_path.write_bytes(data[:-10])
+        checkpoint = log_analyzer.load_checkpoint(checkpoint_path, self.log, log_analyzer.default_settings)
+        self.assertEqual(4000, checkpoint.aggregate[0])
+        resumed = log_analyzer.process_log(self.log, 0.01, checkpoint_path=checkpoint_path, checkpoint_interval=1000)
+        self.assertEqual(log_analyzer.process_log(self.log, 0.01), resumed)
+        self.assertEqual(len(data), checkpoint_path.stat().st_size)
+
+    def test_gzip_log_produces_same_statistics(self):
+        gz_path = self.log_path.with_name(self.log_path.name + ".gz")
+        data = self.log_path.read_bytes()
+        # Несколько gzip-потоков в одном файле, как после cat a.gz b.gz
+        gz_path.write_bytes(gzip.compress(data[:100000]) + gzip.compress(data[100000:]))
+        gz_log = log_analyzer.Log(gz_path, self.log.date, ".gz")
+        self.assertEqual(list(log_analyzer.read_lines(self.log)), list(log_analyzer.read_lines(gz_log)))
+        self.assertEqual(list(log_analyzer.read_lines(self.log, 12345)), list(log_analyzer.read_lines(gz_log, 12345)))
+        self.assertEqual(log_analyzer.process_log(self.log, 0.01), log_analyzer.process_log(gz_log, 0.01))
+
+    def test_truncated_gzip_log_fails(self):
+        gz_path = self.log_path.with_name(self.log_path.name + ".gz")
+        compressed = gzip.compress(self.log_path.read_bytes())
+        gz_path.write_bytes(compressed[:len(compressed) // 2])
+        gz_log = log_analyzer.Log(gz_path, self.log.date, ".gz")
+        with mock.patch.object(log_analyzer.shutil, "which", return_value=None):
+            with self.assertRaises(EOFError):
+                log_analyzer.process_log(gz_log, 0.01)
+
+
+class TestCreateReport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.template_path = pathlib.Path(self.tmp_dir.name) / "report.html"
+        self.report_path = pathlib.Path(self.tmp_dir.name) / "report-2017.06.30.html"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_same_as_safe_substitute(self):
+        self.template_path.write_text("$$x !function($) { var table = ${table_json}; $other $ }")
+        rows = [{"url": "/a", "count": 1}, {"url": "/b\"", "count": 2}]
+        log_analyzer.create_report(self.template_path, self.report_path, iter(rows))
+        expected = string.Template(self.template_path.read_text()).safe_substitute(table_json=json.dumps(rows))
+        self.assertEqual(expected, self.report_path.read_text())
+
+    def test_series_json(self):
+        self.template_path.write_text("var table = $table_json; var series = $series_json;")
+        log_analyzer.create_report(self.template_path, self.report_path, iter([]))
+        self.assertEqual("var table = []; var series = null;", self.report_path.read_text())
+        series = {"resolution": "hour", "total": [{"time": "2017-06-29T03:00", "count": 1}]}
+        log_analyzer.create_report(self.template_path, self.report_path, iter([]), series)
+        self.assertEqual(f"var table = []; var series = {json.dumps(series)};", self.report_path.read_text())
+
+    def test_failed_report_is_not_left_behind(self):
+        self.template_path.write_text("var table = $table_json;")
+
+        def rows():
+            yield {"url": "/a"}
+            raise RuntimeError("interrupted")
+
+        with self.assertRaises(RuntimeError):
+            log_analyzer.create_report(self.template_path, self.report_path, rows())
+        self.assertEqual(["report.html"], [p.name for p in pathlib.Path(self.tmp_dir.name).iterdir()])
+
+    def test_open_error_is_not_masked(self):
+        self.template_path.write_text("var table = $table_json;")
+        path_open = pathlib.Path.open
+
+        def open_template_only(path, mode='r', *args, **kwargs):
+            if mode != 'r':
+                raise PermissionError(path)
+            return path_open(path, mode, *args, **kwargs)
+
+        with mock.patch.object(pathlib.Path, "open", open_template_only):
+            with self.assertRaises(PermissionError):
+                log_analyzer.create_report(self.template_path, self.report_path, [])
+
+
+class LogDirTestCase(unittest.TestCase):
+    """Каталоги логов и отчетов с шаблоном отчета и конфигурация для них"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        root = pathlib.Path(self.tmp_dir.name)
+        self.log_dir = root / "log"
+        self.report_dir = root / "reports"
+        self.log_dir.mkdir()
+        self.report_dir.mkdir()
+        template = pathlib.Path(__file__).parent.parent / "report.html"
+        (self.report_dir / "report.html").write_bytes(template.read_bytes())
+        self.config = {
+            **log_analyzer.default_config,
+            "LOG_DIR": str(self.log_dir),
+            "REPORT_DIR": str(self.report_dir),
+            "TS_FILE": str(root / "log_analyzer.ts"),
+            "WORKERS": 2,
+        }
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+
+class TestBackfill(LogDirTestCase):
+
+    def test_builds_missing_reports(self):
+        data = "".join(make_lines(500)).encode()
+        (self.log_dir / "nginx-access-ui.log-20170628").write_bytes(data)
+        (self.log_dir / "nginx-access-ui.log-20170629.gz").write_bytes(gzip.compress(data))
+        (self.log_dir / "nginx-access-ui.log-20170630").write_bytes(data)
+        (self.log_dir / "nginx-access-ui.log-20170630.gz").write_bytes(gzip.compress(data))
+        (self.log_dir / "nginx-access-ui.log-2017063").write_bytes(data)
+        existing_report = self.report_dir / "report-2017.06.28.html"
+        existing_report.write_text("old")
+
+        log_analyzer.backfill(self.config)
+
+        self.assertEqual(existing_report.read_text(), "old")
+        new_reports = [self.report_dir / "report-2017.06.29.html", self.report_dir / "report-2017.06.30.html"]
+        for report_path in new_reports:
+            self.assertTrue(report_path.exists())
+        self.assertEqual(new_reports[0].read_text(), new_reports[1].read_text())
+        self.assertTrue(pathlib.Path(self.config["TS_FILE"]).exists())
+
+
+class TestGetLastLogfile(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.log_dir = pathlib.Path(self.tmp_dir.name)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_last_logfile(self):
+        for name in ["nginx-access-ui.log-20170629.gz", "nginx-access-ui.log-20170630", "nginx-access-ui.log-20170701.bz2"]:
+            (self.log_dir / name).write_bytes(b"")
+        log = log_analyzer.get_last_logfile(self.log_dir)
+        self.assertEqual(log, log_analyzer.Log(self.log_dir / "nginx-access-ui.log-20170630", datetime.date(2017, 6, 30), ""))
+
+    def test_last_logfile_matches_file_name_only(self):
+        log_dir = self.log_dir / "nginx-access-ui.log-20991231"
+        log_dir.mkdir()
+        for name in ["nginx-access-ui.log-20170629", "nginx-access-ui.log-20170628.gz"]:
+            (log_dir / name).write_bytes(b"")
+        log = log_analyzer.get_last_logfile(log_dir)
+        self.assertEqual(log, log_analyzer.Log(log_dir / "nginx-access-ui.log-20170629", datetime.date(2017, 6, 29), ""))
+        (log_dir / "nginx-access-ui.log-20170630").mkdir()
+        log = log_analyzer.get_last_logfile(log_dir)
+        self.assertEqual(log, log_analyzer.Log(log_dir / "nginx-access-ui.log-20170629", datetime.date(2017, 6, 29), ""))
+        (log_dir / "nginx-access-ui.log-20170629").unlink()
+        (log_dir / "nginx-access-ui.log-20170628.gz").unlink()
+        self.assertIsNone(log_analyzer.get_last_logfile(log_dir))
+
+
+class TestMain(LogDirTestCase):
+
+    def test_main_resumes_appended_log(self):
+        log_path = self.log_dir / "nginx-access-ui.log-20170630"
+        log_path.write_text("".join(make_lines(500)))
+        config = {**self.config, "WORKERS": 1, "CHECKPOINT_INTERVAL": 100}
+        report_path = self.report_dir / "report-2017.06.30.html"
+        log_analyzer.main(config)
+        first_report = report_path.read_text()
+
+        log_analyzer.main(config)
+        self.assertEqual(first_report, report_path.read_text())
+
+        with log_path.open(mode="a") as f:
+            f.write("".join(make_lines(300, seed=1)))
+        report_mtime = report_path.stat().st_mtime
+        os.utime(str(log_path), (report_mtime + 1, report_mtime + 1))
+        log_analyzer.main(config)
+        resumed_report = report_path.read_text()
+        self.assertNotEqual(first_report, resumed_report)
+
+        report_path.unlink()
+        log_analyzer.get_checkpoint_path(pathlib.Path(config["TS_FILE"])).unlink()
+        log_analyzer.main(config)
+        self.assertEqual(resumed_report, report_path.read_text())
+
+
+if __name__ == "__main__":
+    unittest.main()
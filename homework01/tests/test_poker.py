@@ -0,0 +1,157 @@
+import itertools
+import random
+import sys
+import unittest
+
+if sys.version_info[0] > 2:
+    raise unittest.SkipTest("poker.py is written for Python 2")
+
+import poker
+
+
+DECK = [rank + suit for rank in poker.RANKS for suit in poker.SUITS]
+
+
+class TestFastHandRank(unittest.TestCase):
+
+    def test_same_as_hand_rank(self):
+        rnd = random.Random(0)
+        hands = [rnd.sample(DECK, 5) for _ in xrange(20000)]
+        hands += [h.split() for h in ["2C 2D 5H 7S 9C", "2C 2D 2H 7S 7C", "AC 2D 3H 4S 5C",
+                                      "2C 2D 2H 2S 7C", "TS JS QS KS AS", "AS 2S 3S 4S 5S"]]
+        for hand in hands:
+            self.assertEqual(poker.hand_rank(hand), poker.fast_hand_rank(hand))
+
+    def test_codes_are_ordered_as_hand_rank(self):
+        rnd = random.Random(1)
+        hands = [rnd.sample(DECK, 5) for _ in xrange(2000)]
+        for h1, h2 in itertools.izip(hands, hands[1:]):
+            self.assertEqual(cmp(poker.hand_rank(h1), poker.hand_rank(h2)),
+                             cmp(poker.hand_code(h1), poker.hand_code(h2)))
+        self.assertEqual(7462, len(poker.CODE_RANKS))
+
+
+class TestBestHand(unittest.TestCase):
+
+    def test_same_as_combinations(self):
+        rnd = random.Random(2)
+        hands = [rnd.sample(DECK, 7) for _ in xrange(2000)]
+        clubs = [card for card in DECK if card[1] == "C"]
+        others = [card for card in DECK if card[1] != "C"]
+        hands += [rnd.sample(clubs, n) + rnd.sample(others, 7 - n) for n in [5, 6, 7] for _ in xrange(300)]
+        hands += [h.split() for h in ["2C 2D 2H 2S 3C 3D 3H", "AS 2S 3S 4S 5S 6S 7S", "2C 2D 5H 7S 9C JD KH"]]
+        for hand in hands:
+            self.assertEqual(max(itertools.combinations(hand, 5), key=poker.hand_rank), poker.best_hand(hand))
+
+    def test_other_sizes(self):
+        hand = "6C 7C 8C 9C TC 5C".split()
+        self.assertEqual(("6C", "7C", "8C", "9C", "TC"), poker.best_hand(hand))
+
+
+class TestBestWildHand(unittest.TestCase):
+
+    def test_same_rank_as_brute_force(self):
+        rnd = random.Random(3)
+        for i in xrange(150):
+            jokers = [["?B"], ["?R"], ["?B", "?R"]][i % 3]
+            hand = rnd.sample(DECK, 7 - len(jokers)) + jokers
+            rnd.shuffle(hand)
+            self.assertEqual(poker.hand_rank(poker.brute_force_wild_hand(hand)),
+                             poker.hand_rank(poker.best_wild_hand(hand)))
+
+    def test_same_hand_as_brute_force(self):
+        for hand in ["6C 7C 8C 9C TC 5C ?B", "TD TC 5H 5C 7C ?R ?B", "JD TC TH 7C 7D 7S 7H",
+                     "AS KS QS 2S 3H 4H ?B", "2C 2D 2H 5S 5D ?R ?B"]:
+            hand = hand.split()
+            self.assertEqual(sorted(poker.brute_force_wild_hand(hand)), sorted(poker.best_wild_hand(hand)))
+
+
+@unittest.skipIf(poker.np is None, "numpy is not installed")
+class TestBatchBestHands(unittest.TestCase):
+
+    def test_codecs(self):
+        hands = ["2C 3D 4H 5S".split(), "AS KH QD JC".split()]
+        card_ids = poker.encode_hands(hands)
+        self.assertEqual([[0, 7, 10, 13], [49, 46, 43, 36]], card_ids.tolist())
+        self.assertEqual(hands, poker.decode_hands(card_ids))
+
+    def test_same_as_best_hand(self):
+        rnd = random.Random(4)
+        clubs = [card for card in DECK if card[1] == "C"]
+        others = [card for card in DECK if card[1] != "C"]
+        hands = [rnd.sample(DECK, 7) for _ in xrange(3000)]
+        hands += [rnd.sample(clubs, n) + rnd.sample(others, 7 - n) for n in [5, 6, 7] for _ in xrange(300)]
+        card_ids = poker.encode_hands(hands)
+        codes, masks = poker.batch_best_hands(card_ids)
+        best_hands = [poker.best_hand(hand) for hand in hands]
+        self.assertEqual(best_hands, poker.decode_hands(card_ids, masks))
+        self.assertEqual([poker.hand_code(hand) for hand in best_hands], codes.tolist())
+
+    def test_chunks(self):
+        rnd = random.Random(5)
+        card_ids = poker.encode_hands([rnd.sample(DECK, 7) for _ in xrange(1000)])
+        codes, masks = poker.batch_best_hands(card_ids)
+        chunk_size, poker.BATCH_CHUNK_SIZE = poker.BATCH_CHUNK_SIZE, 300
+        try:
+            chunked_codes, chunked_masks = poker.batch_best_hands(card_ids)
+            empty_codes, empty_masks = poker.batch_best_hands(card_ids[:0])
+        finally:
+            poker.BATCH_CHUNK_SIZE = chunk_size
+        self.assertEqual((codes.tolist(), masks.tolist()), (chunked_codes.tolist(), chunked_masks.tolist()))
+        self.assertEqual(([], []), (empty_codes.tolist(), empty_masks.tolist()))
+
+
+class TestWithoutNumpy(unittest.TestCase):
+
+    def setUp(self):
+        self.np, poker.np = poker.np, None
+
+    def tearDown(self):
+        poker.np = self.np
+
+    def test_batch_functions_need_numpy(self):
+        with self.assertRaises(ImportError):
+            poker.encode_hands([["2C", "3D", "4H", "5S", "6C"]])
+        with self.assertRaises(ImportError):
+            poker.batch_best_hands(None)
+
+
+class TestEquity(unittest.TestCase):
+
+    def test_exhaustive(self):
+        result = poker.equity([["AS", "AH"], ["KS", "KH"]], ["QC", "7D", "2S", "3C"])
+        self.assertTrue(result.exhaustive)
+        self.assertEqual(44, result.n_boards)
+        self.assertEqual([42. / 44, 2. / 44], result.win)
+        self.assertEqual([0., 0.], result.tie)
+
+    def test_split_pot(self):
+        result = poker.equity([["2C", "3D"], ["2H", "3S"]], ["AS", "KS", "QD", "JH", "TC"])
+        self.assertEqual(([0., 0.], [1., 1.], [.5, .5]), (result.win, result.tie, result.equity))
+
+    def test_sampling_is_deterministic(self):
+        hole_cards = [["AS", "AH"], ["KS", "KH"], ["7C", "8C"]]
+        result = poker.equity(hole_cards, n_samples=3000, seed=1, batch_size=500)
+        self.assertFalse(result.exhaustive)
+        self.assertEqual(3000, result.n_boards)
+        self.assertEqual(result, poker.equity(hole_cards, n_samples=3000, seed=1, batch_size=500, workers=2))
+        self.assertNotEqual(result, poker.equity(hole_cards, n_samples=3000, seed=2, batch_size=500))
+        self.assertAlmostEqual(1., sum(result.equity))
+
+    def test_precision_stops_early(self):
+        result = poker.equity([["AS", "AH"], ["KS", "KH"]], n_samples=100000, precision=0.02, batch_size=500)
+        self.assertLess(result.n_boards, 100000)
+        self.assertAlmostEqual(0.82, result.equity[0], delta=0.03)
+
+    def test_invalid_cards(self):
+        with self.assertRaises(ValueError):
+            poker.equity([["AS", "AH"], ["AS", "KH"]])
+        for kwargs in [{"n_samples": 0}, {"batch_size": 0}, {"batch_size": -1}]:
+            with self.assertRaises(ValueError):
+                poker.equity([["AS", "AH"], ["KS", "KH"]], **kwargs)
+        with self.assertRaises(ValueError):
+            poker.equity([[DECK[i], DECK[i + 1]] for i in xrange(0, 48, 2)])
+
+
+if __name__ == '__main__':
+    unittest.main()